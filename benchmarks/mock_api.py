@@ -0,0 +1,429 @@
+"""
+Local stand-in for the parts of the Dynatrace API v2 used by ext_ddu_monitoring.
+
+Serves a synthetic tenant of configurable size: problems, metrics/query, extensions,
+monitoringConfigurations, entities and problem comments. Latency and 429 responses
+can be injected. Request counts and transferred bytes are available under /_stats.
+
+    python benchmarks/mock_api.py --port 8080 --ingest-series 50000 --hosts 20000 --configs 2000
+"""
+import argparse, base64, json, random, re, threading, time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Minutes before "now" in which spiking extension configs ingest additional data points
+SPIKE_MINUTES = 10
+
+_PATH_TEMPLATES = [
+    (re.compile(r"^/api/v2/problems/[^/]+/comments$"), "/api/v2/problems/{problemId}/comments"),
+    (re.compile(r"^/api/v2/extensions/[^/]+/monitoringConfigurations/[^/]+$"), "/api/v2/extensions/{extensionName}/monitoringConfigurations/{configurationId}"),
+]
+
+
+class SyntheticTenant:
+    """
+    Deterministic synthetic tenant data
+    """
+
+    def __init__(self, extensions=20, configs=2000, ingest_series=50000, hosts=20000, host_groups=200,
+                 management_zones=50, problems=5, spiking_configs=20, seed=1):
+        rng = random.Random(seed)
+
+        self.extension_names = [f"custom:bench.extension-{index}" for index in range(extensions)]
+        self.host_groups = [f"HOST_GROUP-{index:016X}" for index in range(host_groups)]
+        self.management_zones = [f"mz-{index}" for index in range(management_zones)]
+
+        self.hosts = {}
+        for index in range(hosts):
+            host_id = f"HOST-{index:016X}"
+            self.hosts[host_id] = {
+                "host_group": self.host_groups[index % host_groups],
+                "management_zones": [self.management_zones[index % management_zones]],
+                "ddus_per_minute": rng.uniform(0, 0.1),
+            }
+        self.host_ids = host_ids = list(self.hosts)
+
+        # Configs cycle through host, host group, management zone and ActiveGate scopes
+        self.configs = {}
+        for index in range(configs):
+            config_id = f"config-{index:08d}"
+            scope = [
+                host_ids[index % hosts],
+                self.host_groups[index % host_groups],
+                "management_zone-" + self.management_zones[index % management_zones],
+                "ag_group-default",
+            ][index % 4]
+            self.configs[config_id] = (self.extension_names[index % extensions], scope)
+
+        # Ingest series of extension configs first, the remaining series come from other sources
+        self.ingest_series = []
+        for index, (config_id, (extension_name, _)) in enumerate(self.configs.items()):
+            if len(self.ingest_series) == ingest_series:
+                break
+            self.ingest_series.append(((extension_name, config_id), rng.uniform(10, 1000), index < spiking_configs))
+        for index in range(len(self.ingest_series), ingest_series):
+            self.ingest_series.append(((f"other-source-{index % 10}", f"none-{index:08d}"), rng.uniform(10, 1000), False))
+
+        # Hosts covered by spiking configs get billed additional DDUs during the spike
+        self.spiking_hosts = set()
+        for (extension_name, config_id), _, spiking in self.ingest_series:
+            if spiking and config_id in self.configs:
+                self.spiking_hosts.update(self.hosts_in_scope(self.configs[config_id][1]))
+
+        self.problem_count = problems
+        self.generation = 0
+        self.comments = {}
+
+    def hosts_in_scope(self, scope):
+        if scope.startswith("HOST_GROUP-"):
+            return [host_id for host_id, host in self.hosts.items() if host["host_group"] == scope]
+        if scope.startswith("HOST-"):
+            return [scope]
+        if scope.startswith("management_zone-"):
+            name = scope[len("management_zone-"):]
+            return [host_id for host_id, host in self.hosts.items() if name in host["management_zones"]]
+        return []
+
+    def problems(self):
+        return [
+            {
+                "problemId": f"P-{self.generation}-{index}",
+                "displayId": f"P-{self.generation}{index:04d}",
+                "title": "DDU Monitoring Alert",
+                "status": "OPEN",
+                "recentComments": {"comments": [], "totalCount": 0},
+            }
+            for index in range(self.problem_count)
+        ]
+
+    def rotate_problems(self):
+        self.generation += 1
+
+    def ingest_value(self, base_value, spiking, minute, now_minute):
+        value = base_value / 5
+        if spiking and now_minute - SPIKE_MINUTES <= minute <= now_minute:
+            value += 1000
+        return value
+
+    def ddu_value(self, host_id, minute, now_minute):
+        value = self.hosts[host_id]["ddus_per_minute"]
+        if host_id in self.spiking_hosts and now_minute - SPIKE_MINUTES <= minute <= now_minute:
+            value += 1
+        return value
+
+
+class MockApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tenant, latency=0.0, throttle_every=0):
+        super().__init__(address, MockApiHandler)
+        self.tenant = tenant
+        self.latency = latency
+        self.throttle_every = throttle_every
+
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests = 0
+            self.calls = {}
+            self.throttled = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "requests": self.requests,
+                "calls": dict(self.calls),
+                "throttled": self.throttled,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "comments": sum(len(comments) for comments in self.tenant.comments.values()),
+            }
+
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+
+        # Managed environment URLs contain /e/{environment-id}, every environment serves the same tenant
+        url = url._replace(path=re.sub(r"^/e/[^/]+", "", url.path))
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if url.path.startswith("/_"):
+            return self._control(url.path)
+
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            template = _path_template(url.path)
+            server.calls[f"{method} {template}"] = server.calls.get(f"{method} {template}", 0) + 1
+            server.bytes_received += len(self.requestline) + len(str(self.headers)) + len(body)
+            throttled = server.throttle_every and server.requests % server.throttle_every == 0
+            if throttled:
+                server.throttled += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if throttled:
+            return self._send(429, {"error": {"code": 429, "message": "Too many requests"}}, {"Retry-After": "1"})
+
+        if not self.headers.get("Authorization", "").startswith("Api-Token "):
+            return self._send(401, {"error": {"code": 401, "message": "Missing authorization"}})
+
+        if "nextPageKey" in params:
+            params = _decode_page_key(params["nextPageKey"])
+
+        try:
+            if method == "POST" and url.path.endswith("/comments"):
+                problem_id = url.path.split("/")[-2]
+                server.tenant.comments.setdefault(problem_id, []).append(json.loads(body)["message"])
+                return self._send(201, {})
+            if method == "GET":
+                route = _ROUTES.get(template)
+                if route is not None:
+                    return self._send(200, route(server.tenant, params, url.path))
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": {"code": 400, "message": f"Invalid request: {e}"}})
+
+        self._send(404, {"error": {"code": 404, "message": f"Unknown endpoint {method} {url.path}"}})
+
+    def _control(self, path):
+        if path == "/_stats":
+            return self._send(200, self.server.stats())
+        if path == "/_reset":
+            self.server.reset_stats()
+            return self._send(200, {})
+        if path == "/_rotate":
+            self.server.tenant.rotate_problems()
+            return self._send(200, {})
+        self._send(404, {})
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+        with self.server.stats_lock:
+            self.server.bytes_sent += len(body)
+
+
+def _problems(tenant, params, path):
+    return _page(tenant.problems(), "problems", params)
+
+
+def _comments(tenant, params, path):
+    comments = tenant.comments.get(path.split("/")[-2], [])
+    return _page([{"id": str(index), "content": message} for index, message in enumerate(comments)], "comments", params)
+
+
+def _extensions(tenant, params, path):
+    return _page([{"extensionName": name, "version": "1.0.0"} for name in tenant.extension_names], "extensions", params)
+
+
+def _monitoring_configuration(tenant, params, path):
+    config_id = path.split("/")[-1]
+    extension_name, scope = tenant.configs[config_id]
+    return {"objectId": config_id, "scope": scope, "value": {"enabled": True, "description": extension_name}}
+
+
+def _entities(tenant, params, path):
+    if "type(HOST)" not in params.get("entitySelector", ""):
+        return _page([], "entities", params)
+
+    now = int(time.time() * 1000)
+
+    # Like the real API, only entityId, type and displayName are returned unless further fields are added with "+"
+    fields = {field[1:] for field in params.get("fields", "").split(",") if field.startswith("+")}
+
+    def render(host_id):
+        host = tenant.hosts[host_id]
+        entity = {"entityId": host_id, "type": "HOST", "displayName": host_id}
+        if "lastSeenTms" in fields:
+            entity["lastSeenTms"] = now
+        if "fromRelationships" in fields or "fromRelationships.isInstanceOf" in fields:
+            entity["fromRelationships"] = {"isInstanceOf": [{"id": host["host_group"], "type": "HOST_GROUP"}]}
+        if "managementZones" in fields:
+            entity["managementZones"] = [{"id": name, "name": name} for name in host["management_zones"]]
+        return entity
+
+    return _page(tenant.host_ids, "entities", params, render)
+
+
+def _metrics_query(tenant, params, path):
+    time_from = _parse_time(params["from"])
+    time_to = _parse_time(params["to"])
+    now_minute = int(time.time() // 60)
+
+    results = []
+    for selector in _split_selectors(params["metricSelector"]):
+        shift = _timeshift_minutes(selector)
+        from_minute = time_from // 60000 + shift
+        to_minute = time_to // 60000 + shift
+        minutes = range(from_minute, to_minute)
+
+        offset = int(params.get("offset", 0))
+        page_size = int(params.get("pageSize", 100))
+
+        if selector.startswith("dsfm:server.metrics.ingest.external_datapoints"):
+            series = [
+                ({"source": source, "dt.extension.config.id": config_id}, lambda minute, base=base, spiking=spiking: tenant.ingest_value(base, spiking, minute, now_minute))
+                for (source, config_id), base, spiking in tenant.ingest_series[offset:offset + page_size]
+            ]
+        elif selector.startswith("builtin:billing.ddu.metrics.byEntity"):
+            series = [
+                ({"dt.entity.monitored_entity": host_id}, lambda minute, host_id=host_id: tenant.ddu_value(host_id, minute, now_minute))
+                for host_id in tenant.host_ids[offset:offset + page_size]
+            ]
+        else:
+            raise ValueError(f"unknown metric selector {selector}")
+
+        data = []
+        for dimension_map, value in series:
+            if ":fold(" in selector:
+                data.append({"dimensionMap": dimension_map, "timestamps": [time_to], "values": [sum(value(minute) for minute in minutes)]})
+            else:
+                data.append({
+                    "dimensionMap": dimension_map,
+                    "timestamps": [(minute - shift) * 60000 for minute in minutes],
+                    "values": [value(minute) for minute in minutes],
+                })
+        results.append({"metricId": selector, "dataPointCountRatio": 0.0, "dimensionCountRatio": 0.0, "data": data})
+
+    total = max(len(tenant.ingest_series), len(tenant.hosts))
+    page = {"totalCount": total, "resolution": params.get("resolution", "Inf"), "result": results}
+    offset = int(params.get("offset", 0)) + int(params.get("pageSize", 100))
+    if any(len(result["data"]) for result in results) and offset < total:
+        page["nextPageKey"] = _encode_page_key(dict(params, offset=offset))
+    return page
+
+
+_ROUTES = {
+    "/api/v2/problems": _problems,
+    "/api/v2/problems/{problemId}/comments": _comments,
+    "/api/v2/extensions": _extensions,
+    "/api/v2/extensions/{extensionName}/monitoringConfigurations/{configurationId}": _monitoring_configuration,
+    "/api/v2/entities": _entities,
+    "/api/v2/metrics/query": _metrics_query,
+}
+
+
+def _page(items, items_key, params, render=None):
+    offset = int(params.get("offset", 0))
+    page_size = int(params.get("pageSize", 50))
+    page_items = items[offset:offset + page_size]
+    if render is not None:
+        page_items = [render(item) for item in page_items]
+
+    page = {"totalCount": len(items), "pageSize": page_size, items_key: page_items}
+    if offset + page_size < len(items):
+        page["nextPageKey"] = _encode_page_key(dict(params, offset=offset + page_size))
+    return page
+
+
+def _encode_page_key(params):
+    return base64.urlsafe_b64encode(json.dumps(params).encode("utf-8")).decode("ascii")
+
+
+def _decode_page_key(page_key):
+    return json.loads(base64.urlsafe_b64decode(page_key.encode("ascii")))
+
+
+def _path_template(path):
+    for pattern, template in _PATH_TEMPLATES:
+        if pattern.match(path):
+            return template
+    return path
+
+
+def _parse_time(value):
+    if value.lstrip("-").isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def _split_selectors(metric_selector):
+    # Split at top-level commas, commas inside parentheses or quotes belong to a selector
+    selectors, depth, quoted, start = [], 0, False, 0
+    for index, char in enumerate(metric_selector):
+        if char == "\"" and metric_selector[index - 1:index] != "~":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            selectors.append(metric_selector[start:index].strip())
+            start = index + 1
+    selectors.append(metric_selector[start:].strip())
+    return selectors
+
+
+def _timeshift_minutes(selector):
+    match = re.search(r":timeshift\((-?\d+)([mhdw])\)", selector)
+    if not match:
+        return 0
+    return int(match.group(1)) * {"m": 1, "h": 60, "d": 1440, "w": 10080}[match.group(2)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Dynatrace API for ext_ddu_monitoring benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_tenant_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockApiServer((args.host, args.port), tenant_from_arguments(args), args.latency / 1000, args.throttle_every)
+    print(f"Mock Dynatrace API listening on http://{args.host}:{server.server_port}")
+    server.serve_forever()
+
+
+def add_tenant_arguments(parser):
+    parser.add_argument("--extensions", type=int, default=20)
+    parser.add_argument("--configs", type=int, default=2000)
+    parser.add_argument("--ingest-series", type=int, default=50000)
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--host-groups", type=int, default=200)
+    parser.add_argument("--management-zones", type=int, default=50)
+    parser.add_argument("--problems", type=int, default=5)
+    parser.add_argument("--spiking-configs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request in milliseconds")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every n-th request with 429")
+
+
+def tenant_from_arguments(args):
+    return SyntheticTenant(
+        extensions=args.extensions,
+        configs=args.configs,
+        ingest_series=args.ingest_series,
+        hosts=args.hosts,
+        host_groups=args.host_groups,
+        management_zones=args.management_zones,
+        problems=args.problems,
+        spiking_configs=args.spiking_configs,
+    )
+
+
+if __name__ == "__main__":
+    main()
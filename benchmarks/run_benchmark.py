@@ -0,0 +1,187 @@
+"""
+Benchmark of ExtensionImpl.query against the local mock Dynatrace API.
+
+Starts the mock API in a separate process, runs a number of query() cycles and reports
+per cycle the wall time, API calls, bytes transferred, posted comments and the peak RSS
+of the benchmark process and, with --process-workers, of all worker processes together.
+
+    python benchmarks/run_benchmark.py --cycles 3 --ingest-series 50000 --hosts 20000 --configs 2000 --problems 10
+"""
+import argparse, json, logging, multiprocessing, os, sys, tempfile, threading, time, urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mock_api import MockApiServer, add_tenant_arguments, tenant_from_arguments
+
+
+def serve(args, port_queue):
+    server = MockApiServer(("127.0.0.1", 0), tenant_from_arguments(args), args.latency / 1000, args.throttle_every)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def control(server_url, path):
+    with urllib.request.urlopen(server_url + path) as response:
+        return json.loads(response.read())
+
+
+def lifetime_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """
+    Samples the RSS of the benchmark process and of the extension's worker processes during a cycle.
+
+    ru_maxrss is the peak over the lifetime of a process and only covers children which have exited,
+    so the per-cycle peaks are sampled from /proc where available and fall back to ru_maxrss elsewhere.
+    """
+
+    def __init__(self, worker_pids, interval=0.02):
+        self.worker_pids = worker_pids
+        self.interval = interval
+        self.peak_rss = None
+        self.peak_worker_rss = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while True:
+            rss = rss_mb(os.getpid())
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+            worker_rss = [rss_mb(pid) for pid in self.worker_pids()]
+            if worker_rss and None not in worker_rss:
+                self.peak_worker_rss = max(self.peak_worker_rss or 0, sum(worker_rss))
+
+            if self._stopped.wait(self.interval):
+                return
+
+
+def worker_pids(extension):
+    worker_pool = getattr(extension, "_worker_pool", None)
+    if worker_pool is None:
+        return []
+    return [process.pid for process in worker_pool._processes if process is not None and process.is_alive()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ext_ddu_monitoring against a mock Dynatrace API")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--endpoints", type=int, default=1, help="Number of configured endpoints, each one a separate environment")
+    parser.add_argument("--process-workers", type=int, default=0, help="Number of worker processes the endpoints are distributed to, 0 for threads only")
+    parser.add_argument("--same-problems", action="store_true", help="Do not open new problems for every cycle")
+    parser.add_argument("--state-dir", help="State directory of the extension, a new temporary directory by default")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the log output of the extension")
+    add_tenant_arguments(parser)
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.get_context("spawn").Queue()
+    server_process = multiprocessing.get_context("spawn").Process(target=serve, args=(args, port_queue), daemon=True)
+    server_process.start()
+    server_url = f"http://127.0.0.1:{port_queue.get(timeout=300)}"
+
+    from ext_ddu_monitoring.storage import STATE_DIR_ENV
+    os.environ[STATE_DIR_ENV] = args.state_dir or tempfile.mkdtemp(prefix="ddu_benchmark_")
+
+    from ext_ddu_monitoring.__main__ import ExtensionImpl
+
+    class BenchmarkExtension(ExtensionImpl):
+
+        @property
+        def activation_config(self):
+            return self.benchmark_config
+
+        @activation_config.setter
+        def activation_config(self, value):
+            pass
+
+    extension = BenchmarkExtension(name="ext_ddu_monitoring")
+    extension.benchmark_config = {
+        "endpoints": [
+            {
+                "environment_url": f"{server_url}/e/benchmark-{index}",
+                "api_token": "dt0c01.BENCHMARK",
+                "problem_text": "DDU Monitoring Alert",
+                "datapoint_delta_threshold": 100,
+                "verify_ssl": False,
+            }
+            for index in range(args.endpoints)
+        ],
+        "process_workers": args.process_workers,
+    }
+    if not args.verbose:
+        extension.logger.setLevel(logging.WARNING)
+
+    results = []
+    for cycle in range(1, args.cycles + 1):
+        control(server_url, "/_reset")
+        if cycle > 1 and not args.same_problems:
+            control(server_url, "/_rotate")
+
+        with RssSampler(lambda: worker_pids(extension)) as rss_sampler:
+            start_time = time.perf_counter()
+            extension.query()
+            wall_time = time.perf_counter() - start_time
+
+        stats = control(server_url, "/_stats")
+        results.append({
+            "cycle": cycle,
+            "wall_time_s": round(wall_time, 3),
+            "api_calls": stats["requests"],
+            "throttled": stats["throttled"],
+            "bytes_received_mb": round(stats["bytes_sent"] / 1e6, 2),
+            "bytes_sent_mb": round(stats["bytes_received"] / 1e6, 2),
+            "comments": stats["comments"],
+            "peak_rss_mb": round(rss_sampler.peak_rss or lifetime_peak_rss_mb() or 0, 1) or None,
+            "workers_peak_rss_mb": rss_sampler.peak_worker_rss and round(rss_sampler.peak_worker_rss, 1),
+            "calls": stats["calls"],
+        })
+
+    server_process.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'cycle':>5} {'wall [s]':>9} {'API calls':>9} {'429':>5} {'recv [MB]':>9} {'sent [MB]':>9} {'comments':>8} {'peak RSS [MB]':>13} {'workers RSS [MB]':>16}")
+    for result in results:
+        print(f"{result['cycle']:>5} {result['wall_time_s']:>9.3f} {result['api_calls']:>9} {result['throttled']:>5} "
+              f"{result['bytes_received_mb']:>9.2f} {result['bytes_sent_mb']:>9.2f} {result['comments']:>8} {result['peak_rss_mb'] or '-':>13} {result['workers_peak_rss_mb'] or '-':>16}")
+
+    print()
+    print("API calls of the last cycle:")
+    for call, count in sorted(results[-1]["calls"].items()):
+        print(f"  {count:>6}  {call}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,24 @@
 from dynatrace_extension import Extension, Status, StatusValue
-import requests, traceback
-from datetime import datetime, timezone, timedelta
+import threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from ext_ddu_monitoring import analysis
+from ext_ddu_monitoring.analysis import DEFAULT_ANALYSIS_TIMEOUT, endpoint_key
+from ext_ddu_monitoring.deadline import Deadline
+from ext_ddu_monitoring.workers import WorkerPool
+
+# Default number of endpoints analyzed at the same time in threads
+DEFAULT_PARALLEL_ENDPOINTS = 10
+
+# Additional time in seconds granted to an endpoint to stop after its deadline has passed
+DEADLINE_GRACE_PERIOD = 5
+
+# Endpoint keys whose analysis is still running in a thread, possibly past its deadline from an earlier cycle
+_running_endpoints = set()
+_running_endpoints_lock = threading.Lock()
+
+# Monotonic time at which the analysis of an endpoint key last completed
+_last_completed = {}
 
 class ExtensionImpl(Extension):
 
@@ -10,39 +28,104 @@ class ExtensionImpl(Extension):
         """
         self.logger.info("Query method started for ext_ddu_monitoring.")
 
-        for endpoint in self.activation_config["endpoints"]:
-
-            # Dynatrace Environment URL | Managed: https://{your-domain}/e/{your-environment-id} | SaaS: https://{your-environment-id}.live.dynatrace.com
-            environment_url = endpoint["environment_url"]
-
-            # API Token with following permissions: 
-            # - Read problems
-            # - Write problems
-            # - Read metrics
-            # - Read entities
-            # - Read extensions
-            # - Read extension monitoring configurations
-            api_token = endpoint["api_token"]
-
-            # Text for fetching problems by problem text
-            problem_text = endpoint["problem_text"]
-
-            # Threshold for datapoint increase to define which extensions should be considered for analysis
-            datapoint_delta_threshold = endpoint["datapoint_delta_threshold"]
+        # Endpoints which have not completed for the longest time are started first, so endpoints cancelled
+        # because the cycle ran out of time are not cancelled again at the end of the next cycle
+        with _running_endpoints_lock:
+            endpoints = sorted(self.activation_config["endpoints"], key=lambda endpoint: _last_completed.get(endpoint_key(endpoint), 0.0))
+        deadlines = [Deadline(endpoint.get("analysis_timeout", DEFAULT_ANALYSIS_TIMEOUT)) for endpoint in endpoints]
 
-            # Enable/disable verify SSL certificate for API requests
-            verify_ssl = endpoint["verify_ssl"]
+        # Number of worker processes the endpoints are distributed to, 0 analyzes all endpoints in threads of this process
+        process_workers = self.activation_config.get("process_workers", 0)
 
-            # ================================================================================================
-            # ================================================================================================
+        if process_workers > 0:
+            self.query_in_processes(endpoints, deadlines, process_workers)
+        else:
+            self.close_worker_pool()
+            self.query_in_threads(endpoints, deadlines, self.activation_config.get("parallel_endpoints", DEFAULT_PARALLEL_ENDPOINTS))
 
-            # Monitor extension DDU consumption related problems
-            self.monitor_ddu_problems(environment_url, api_token, problem_text, datapoint_delta_threshold, verify_ssl)
+        self.logger.info("Query method ended for ext_ddu_monitoring.")
 
-            # ================================================================================================
-            # ================================================================================================
+    def query_in_threads(self, endpoints, deadlines, parallel_endpoints):
+        # Endpoints sharing their problem state are analyzed one after another in the same thread
+        groups = {}
+        for endpoint, deadline in zip(endpoints, deadlines):
+            groups.setdefault(endpoint_key(endpoint), []).append((endpoint, deadline))
+
+        # Endpoints are analyzed concurrently, so the cycle takes as long as the slowest endpoint
+        executor = ThreadPoolExecutor(max_workers=min(parallel_endpoints, len(groups)), thread_name_prefix="ddu_endpoint")
+        futures = {}
+
+        for key, group in groups.items():
+            # Never analyze a problem state twice at the same time
+            with _running_endpoints_lock:
+                if key in _running_endpoints:
+                    self.logger.warning(f"Analysis of endpoint {key[0]} with problem text {key[1]} from an earlier cycle is still running, skipping it in this cycle.")
+                    continue
+                _running_endpoints.add(key)
+
+            futures[executor.submit(self.analyze_endpoints_once, key, group)] = (key, group)
+
+        for future, (key, group) in futures.items():
+            deadline = max((deadline for _, deadline in group), key=Deadline.remaining)
+            try:
+                future.result(timeout=deadline.remaining() + DEADLINE_GRACE_PERIOD)
+            except FutureTimeoutError:
+                if future.cancel():
+                    with _running_endpoints_lock:
+                        _running_endpoints.discard(key)
+                    self.logger.warning(f"Analysis of endpoint {key[0]} was cancelled, deadline of {deadline.seconds}s exceeded before it started.")
+                else:
+                    self.logger.warning(f"Analysis of endpoint {key[0]} did not stop within its deadline of {deadline.seconds}s.")
+            except Exception:
+                self.logger.error(f"Analysis of endpoint {key[0]} failed.")
+                self.logger.error(traceback.format_exc())
+
+        # Do not block the next cycle on endpoints which are still running past their deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def query_in_processes(self, endpoints, deadlines, process_workers):
+        # Worker processes are kept across cycles, so every environment keeps being analyzed by the same warm worker
+        worker_pool = getattr(self, "_worker_pool", None)
+        if worker_pool is None or worker_pool.workers != process_workers:
+            if worker_pool is not None:
+                worker_pool.close()
+            else:
+                # Workers load the state files, the copies kept by this process must not overwrite their changes
+                analysis.release_persisted_state()
+            worker_pool = self._worker_pool = WorkerPool(process_workers, self.logger)
+
+        for endpoint, deadline, metrics in worker_pool.run(endpoints, deadlines, DEADLINE_GRACE_PERIOD):
+            if metrics is None:
+                self.logger.warning(f"Analysis of endpoint {endpoint['environment_url']} did not finish within its deadline of {deadline.seconds}s in its worker process.")
+            else:
+                _completed(endpoint)
+                self.report_metrics(metrics)
+
+    def close_worker_pool(self):
+        # Idle workers keep their copies of the state files, which would overwrite the changes of this process
+        worker_pool = getattr(self, "_worker_pool", None)
+        if worker_pool is not None:
+            worker_pool.close()
+            self._worker_pool = None
+
+    def analyze_endpoints_once(self, key, group):
+        try:
+            for endpoint, deadline in group:
+                self.analyze_endpoint(endpoint, deadline)
+                _completed(endpoint)
+        finally:
+            with _running_endpoints_lock:
+                _running_endpoints.discard(key)
+
+    def analyze_endpoint(self, endpoint, deadline):
+        """
+        Runs the analysis of a single endpoint in the current thread and reports its self-monitoring metrics
+        """
+        self.report_metrics(analysis.analyze_endpoint(endpoint, deadline, self.logger))
 
-        self.logger.info("Query method ended for ext_ddu_monitoring.")
+    def report_metrics(self, metrics):
+        for key, value, dimensions in metrics:
+            self.report_metric(key, value, dimensions)
 
     def fastcheck(self) -> Status:
         """
@@ -50,339 +133,10 @@ class ExtensionImpl(Extension):
         If this AG cannot run this extension, raise an Exception or return StatusValue.ERROR!
         """
         return Status(StatusValue.OK)
-    
-    def monitor_ddu_problems(self, environment_url, api_token, problem_text, datapoint_delta_threshold, verify_ssl):
-
-        # Class for mapping delta of currently and previously ingested data points for an extension configuration
-        class ExtensionConsumption:
-
-            # constructor function    
-            def __init__(self, extension_name = "", config_id = "", current_datapoints = 0, previous_datapoints = 0):
-                self.extension_name = extension_name
-                self.config_id = config_id
-                self.current_datapoints = current_datapoints
-                self.previous_datapoints = previous_datapoints
-                self.affected_entities = []
-
-            def delta(self):
-                return self.current_datapoints - self.previous_datapoints
-
-        try:
-            self.logger.info(f"Analyzing DDU problems for endpoint {environment_url} with problem text: {problem_text}.")
-
-            datetime_to = datetime.now(timezone.utc)
-            datetime_from = datetime_to - timedelta(minutes=5)
-
-            time_to = datetime_to.isoformat(timespec='milliseconds')
-            time_from = datetime_from.isoformat(timespec='milliseconds')
-
-            # Fetch DDU monitoring alert problems
-            # =================================================================================
-            problems_api = environment_url + "/api/v2/problems"
-            problem_selector = f"status(open),text({problem_text})"
-
-            problem_datetime_from = datetime_to - timedelta(minutes=1)
-            problem_time_from = problem_datetime_from.isoformat(timespec='milliseconds')
-            problem_time_to = time_to
-
-            params = {
-                "api-token": api_token, 
-                "pageSize": 10,
-                "from": problem_time_from, 
-                "to": problem_time_to, 
-                "problemSelector": problem_selector,
-                "fields": "recentComments"
-            }
-            response = requests.get(problems_api, params, verify=verify_ssl)
-            problems = response.json()["problems"]
-
-            self.logger.info(f"Number of detected problems for analysis: {len(problems)}.")
-
-            # Start root cause analysis of DDU spike for each problem
-            # =================================================================================
-            for problem in problems:
-                
-                # Check if problem has already been analyzed and commented
-                if problem["recentComments"]["totalCount"] == 0:
-
-                    self.logger.info(f"Analyzing problem with ID: {problem['problemId']}.")
-                    
-                    # Get ingested metric data points split by extension and config for current period
-                    # =================================================================================
-                    metrics_query_api = environment_url + "/api/v2/metrics/query"
-                    metric_selector = "dsfm:server.metrics.ingest.external_datapoints:splitBy(source,\"dt.extension.config.id\"):sort(value(auto,descending)):fold(sum)"
-
-                    # Check last 5 min
-                    params = {
-                        "api-token": api_token, 
-                        "metricSelector": metric_selector,
-                        "from": time_from,
-                        "to": time_to,
-                        "pageSize": 10000
-                    }
-                    response = requests.get(metrics_query_api, params, verify=verify_ssl)
-                    metric_resultlist = response.json()["result"][0]["data"]
-
-                    # Get ingested metric data points split by extension and config for previous period
-                    # =================================================================================
-                    datetime_from_shifted = datetime_from - timedelta(hours=1)
-                    datetime_to_shifted = datetime_to - timedelta(hours=1)
-
-                    time_from_shifted = datetime_from_shifted.isoformat(timespec='milliseconds')
-                    time_to_shifted = datetime_to_shifted.isoformat(timespec='milliseconds')
-
-                    # For comparison shift the 5 min period 1 hour earlier
-                    params = {
-                        "api-token": api_token, 
-                        "metricSelector": metric_selector,
-                        "from": time_from_shifted,
-                        "to": time_to_shifted,
-                        "pageSize": 10000
-                    }
-                    response = requests.get(metrics_query_api, params, verify=verify_ssl)
-                    shifted_metric_resultlist = response.json()["result"][0]["data"]
-
-                    # Get list of extension names
-                    # =================================================================================
-                    extensions_api = environment_url + "/api/v2/extensions"
-
-                    params = {
-                        "api-token": api_token, 
-                        "pageSize": 100
-                    }
-                    response = requests.get(extensions_api, params, verify=verify_ssl)
-                    extension_list = response.json()["extensions"]
-
-                    extension_names = []
-                    for ext in extension_list:
-                        extension_names.append(ext["extensionName"])
-
-                    # Collect data points per extension config for current period
-                    # =================================================================================
-
-                    # Dictionary to hold consumption data for each extension
-                    extension_dict = {}
-
-                    for metric_data in metric_resultlist:
-                        
-                        source = metric_data["dimensionMap"]["source"] # source contains extension name
-                        extension_config_id = metric_data["dimensionMap"]["dt.extension.config.id"]
-                        
-                        if source in extension_names: # if source is an extension
-                            key = source + "|" + extension_config_id
-                            value = metric_data["values"][0]
-
-                            if key in extension_dict:
-                                extension_dict[key].current_datapoints += value
-                            else:
-                                extension_dict[key] = ExtensionConsumption(source, extension_config_id, value, 0)
-
-                    # Collect data points per extension config for previous period
-                    # =================================================================================
-
-                    for metric_data in shifted_metric_resultlist:
-                        
-                        source = metric_data["dimensionMap"]["source"] # source contains extension name
-                        extension_config_id = metric_data["dimensionMap"]["dt.extension.config.id"]
-                        
-                        if source in extension_names: # if source is an extension
-                            key = source + "|" + extension_config_id
-                            value = metric_data["values"][0]
-
-                            if key in extension_dict:
-                                extension_dict[key].previous_datapoints += value
-                            else:
-                                extension_dict[key] = ExtensionConsumption(source, extension_config_id, 0, value)
-
-                    # Collect extensions where delta exceeds the defined threshold
-                    # =================================================================================
-                    extensions = []
-                    
-                    for key in extension_dict.keys():
-                        extension = extension_dict[key]
-                        if extension.delta() > datapoint_delta_threshold:
-                            extensions.append(extension)
-
-                    self.logger.info(f"Found {len(extensions)} extensions which exceed the specified threshold of {datapoint_delta_threshold} for datapoints increase.")
-
-                    # Create dictionary of billed DDUs per host entity
-                    # =================================================================================
-                    ddu_by_host_dict = {}
-                    ddu_by_hostselector = "builtin:billing.ddu.metrics.byEntity:filter(in(\"dt.entity.monitored_entity\", entitySelector(\"type(~\"HOST~\")\"))):splitBy(\"dt.entity.monitored_entity\"):sort(value(auto,descending)):fold(sum)"
-                        
-                    # Collect DDUs per host entity for current timeframe
-                    params = {
-                        "api-token": api_token, 
-                        "metricSelector": ddu_by_hostselector,
-                        "from": time_from,
-                        "to": time_to,
-                        "pageSize": 10000
-                    }
-                    response = requests.get(metrics_query_api, params, verify=verify_ssl)
-                    metric_resultlist = response.json()["result"][0]["data"]
-
-                    # Summarize DDUs per host entity for current period
-                    for metric_data in metric_resultlist:
-                        
-                        entity_id = metric_data.dimensionMap['dt.entity.monitored_entity']
-                        billed_ddus = metric_data.values[0]
-                        
-                        if entity_id not in ddu_by_host_dict:
-                            ddu_by_host_dict[entity_id] = {
-                                "current_billed_ddus": 0,
-                                "previous_billed_ddus": 0
-                            }
-
-                        ddu_by_host_dict[entity_id].current_billed_ddus += billed_ddus
-
-                    # Collect DDUs per host entity for previous timeframe
-                    params = {
-                        "api-token": api_token, 
-                        "metricSelector": ddu_by_hostselector,
-                        "from": time_from_shifted,
-                        "to": time_to_shifted,
-                        "pageSize": 10000
-                    }
-                    response = requests.get(metrics_query_api, params, verify=verify_ssl)
-                    metric_resultlist = response.json()["result"][0]["data"]
-
-                    # Summarize DDUs per host entity for previous period
-                    for metric_data in metric_resultlist:
-                        
-                        entity_id = metric_data.dimensionMap['dt.entity.monitored_entity']
-                        billed_ddus = metric_data.values[0]
-                        
-                        if entity_id not in ddu_by_host_dict:
-                            ddu_by_host_dict[entity_id] = {
-                                "current_billed_ddus": 0,
-                                "previous_billed_ddus": 0
-                            }
-
-                        ddu_by_host_dict[entity_id].previous_billed_ddus += billed_ddus
-
-                    # Determine extensions where data point increase was billable
-                    # =================================================================================
-                    bill_affecting_extensions = []
-                    monitored_entities_api = environment_url + "/api/v2/entities"
-
-                    for ext in extensions:
-                        # Get scope of extension monitoring configuration
-                        monitoring_configuration_api = environment_url + f"/api/v2/extensions/{ext.extension_name}/monitoringConfigurations/{ext.config_id}"
-
-                        params = {
-                            "api-token": api_token, 
-                        }
-                        response = requests.get(monitoring_configuration_api, params, verify=verify_ssl)
-                        configDetails = response.json()
-                        scope = configDetails["scope"]
-                        
-                        # Check if OneAgent extension
-                        if scope.startswith("HOST") or scope.startswith("management_zone"):
-                            
-                            # Collect host entity Ids of extension scope
-                            entity_ids = []
-
-                            if scope.startswith("HOST_GROUP"):
-                                
-                                hostgroup_selector = f"type(HOST),fromRelationships.isInstanceOf(entityId({scope}))"
-                                params = {
-                                    "api-token": api_token, 
-                                    "pageSize": 500,
-                                    "from": time_from_shifted,
-                                    "to": time_to,
-                                    "entitySelector": hostgroup_selector,
-                                }
-                                response = requests.get(monitored_entities_api, params, verify=verify_ssl)
-                                entities = response.json()["entities"]
-
-                                host_ids = []
-                                for host in entities:
-                                    host_ids.append(host["entityId"])
-                                
-                                entity_ids.push(host_ids)
-
-                            elif scope.startswith("HOST"):
-                                entity_ids.append(scope)
-
-                            elif scope.startswith("management_zone"):
-
-                                mgmt_zone_name = scope.substring(16); # removing 'management_zone-'
-                                mgmt_zone_selector = f"type(HOST),mzName({mgmt_zone_name}))"
-                                
-                                params = {
-                                    "api-token": api_token, 
-                                    "pageSize": 500,
-                                    "from": time_from_shifted,
-                                    "to": time_to,
-                                    "entitySelector": mgmt_zone_selector,
-                                }
-                                response = requests.get(monitored_entities_api, params, verify=verify_ssl)
-                                entities = response.json()["entities"]
-
-                                host_ids = []
-                                for host in entities:
-                                    host_ids.append(host["entityId"])
-                                
-                                entity_ids.push(host_ids)
-
-                            # Check for each entity if DDU consumption was covered by free tier
-                            for entity_id in entity_ids:
-                                
-                                if entity_id in ddu_by_host_dict:
-                                    
-                                    entity = ddu_by_host_dict[entity_id]
-                                    
-                                    # Check if there was an increase of billable DDUs
-                                    delta = entity["current_billed_ddus"] - entity["previous_billed_ddus"]
-                                    if delta > 0:
-                                        ext.affected_entities.append(entity_id)
-                                        bill_affecting_extensions.append(ext)
-
-                        else:
-                            # ActiveGate extensions are assumed to be billable
-                            bill_affecting_extensions.append(ext)
-
-                    # Post comment to problem with analysis result
-                    # =================================================================================
-                    
-                    problem_id = problem["problemId"]
-                    problem_comment_api = environment_url + f"/api/v2/problems/{problem_id}/comments"
-
-                    if len(bill_affecting_extensions) > 0:
-                        
-                        self.logger.info(f"Detected {len(bill_affecting_extensions)} bill-affecting extensions.")
-
-                        message = "DDU root cause analysis: \n"
-                        
-                        for ext in bill_affecting_extensions:
-                            message += f"Extension: {ext.extension_name} \nConfig ID: {ext.config_id} \nData point increase: {ext.delta()} \nAffected Entities: {', '.join(ext.affected_entities)} \n====================\n"
-                    
-                        params = {
-                            "api-token": api_token, 
-                            "message": message
-                        }
-                        requests.post(problem_comment_api, params, verify=verify_ssl)
-
-                    else:
-                        self.logger.info("No bill-affecting extensions were detected.")
-                        
-                        message = "DDU root cause analysis: \nNo bill-affecting extensions were detected."
-                        params = {
-                            "api-token": api_token, 
-                            "message": message
-                        }
-                        requests.post(problem_comment_api, params, verify=verify_ssl)
-                        
-                    self.logger.info(f"Added comment with analysis result to problem {problem_id}.")
-
-                else:
-                    self.logger.info(f"Problem with ID {problem['problemId']} has already been analyzed.")
-
-            self.logger.info(f"Finished analysis of DDU problems.")    
 
-        except:
-            self.logger.error("ERROR WHILE MONITORING DDU PROBLEMS")
-            self.logger.error(traceback.format_exc())
+def _completed(endpoint):
+    with _running_endpoints_lock:
+        _last_completed[endpoint_key(endpoint)] = time.monotonic()
 
 def main():
     ExtensionImpl(name="ext_ddu_monitoring").run()
@@ -0,0 +1,89 @@
+import operator
+from array import array
+from itertools import compress
+
+
+class ExtensionConsumption:
+    """
+    Delta of currently and previously ingested data points for an extension configuration
+    """
+
+    def __init__(self, extension_name = "", config_id = "", current_datapoints = 0, previous_datapoints = 0):
+        self.extension_name = extension_name
+        self.config_id = config_id
+        self.current_datapoints = current_datapoints
+        self.previous_datapoints = previous_datapoints
+        self.affected_entities = []
+        self.estimated_ddus = 0.0
+
+    def delta(self):
+        return self.current_datapoints - self.previous_datapoints
+
+
+class DeltaTable:
+    """
+    Current and previous values of many series in columnar form.
+
+    Series keys are interned to row numbers once, values are summed up into two array-backed
+    columns and deltas, threshold filtering and ranking run over whole columns
+    instead of one Python object per series.
+    """
+
+    def __init__(self, current_pairs=(), previous_pairs=()):
+        self.keys = []
+        self.current = array("d")
+        self.previous = array("d")
+        self._index = {}
+
+        self.add_current(current_pairs)
+        self.add_previous(previous_pairs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_current(self, pairs):
+        self._accumulate(pairs, self.current)
+
+    def add_previous(self, pairs):
+        self._accumulate(pairs, self.previous)
+
+    def deltas(self):
+        return array("d", map(operator.sub, self.current, self.previous))
+
+    def deltas_above(self, threshold):
+        """
+        Returns a dict of key to delta of the series whose delta exceeds the threshold
+        """
+        deltas = self.deltas()
+        return dict(compress(zip(self.keys, deltas), map(float(threshold).__lt__, deltas)))
+
+    def select(self, threshold, accept=None):
+        """
+        Returns (key, current, previous, delta) of the series whose delta exceeds the threshold,
+        sorted by descending delta. Only keys for which accept(key) is true are considered.
+        """
+        deltas = self.deltas()
+        rows = compress(range(len(deltas)), map(float(threshold).__lt__, deltas))
+        if accept is not None:
+            rows = (row for row in rows if accept(self.keys[row]))
+
+        rows = sorted(rows, key=deltas.__getitem__, reverse=True)
+
+        return [(self.keys[row], self.current[row], self.previous[row], deltas[row]) for row in rows]
+
+    def _accumulate(self, pairs, column):
+        index = self._index
+        keys = self.keys
+
+        for key, value in pairs:
+            if value is None:
+                continue
+
+            row = index.get(key)
+            if row is None:
+                row = index[key] = len(keys)
+                keys.append(key)
+                self.current.append(0.0)
+                self.previous.append(0.0)
+
+            column[row] += value
@@ -0,0 +1,277 @@
+import requests, traceback, time
+from datetime import datetime, timezone, timedelta
+
+from ext_ddu_monitoring.aggregation import ExtensionConsumption
+from ext_ddu_monitoring.attribution import resolve_scopes, attribute
+from ext_ddu_monitoring.catalog import get_extension_catalog
+from ext_ddu_monitoring.client import get_client
+from ext_ddu_monitoring.deadline import Deadline, DeadlineExceeded
+from ext_ddu_monitoring.outbox import close_comment_outboxes, get_comment_outbox, split_message
+from ext_ddu_monitoring.scopes import get_scope_index
+from ext_ddu_monitoring.snapshot import MetricSnapshot
+from ext_ddu_monitoring.state import forget_problem_states, get_problem_state
+from ext_ddu_monitoring.telemetry import METRIC_PREFIX, Telemetry, collect
+from ext_ddu_monitoring.timeseries import forget_baseline_stores, get_baseline_store
+
+# Default time in seconds an endpoint analysis may take before it is stopped
+DEFAULT_ANALYSIS_TIMEOUT = 50
+
+# Default number of hours the comparison window lies before the analysis window
+DEFAULT_BASELINE_OFFSET_HOURS = 1
+
+
+def endpoint_key(endpoint):
+    """
+    Returns the key of an endpoint's problem state. Endpoints with the same key must not be analyzed at the same time.
+    """
+    return endpoint["environment_url"], endpoint["problem_text"]
+
+
+def release_persisted_state():
+    """
+    Drops the problem states, comment outboxes and baseline stores kept by this process, once the comments
+    being posted are delivered. Required before other processes analyze the endpoints, as the copies of
+    this process would overwrite the state files written by them.
+    """
+    close_comment_outboxes()
+    forget_problem_states()
+    forget_baseline_stores()
+
+
+def analyze_endpoint(endpoint, deadline, logger):
+    """
+    Runs the analysis of a single endpoint and logs its wall time.
+    Returns (metric key, value, dimensions) of the self-monitoring metrics to report.
+    """
+    # Dynatrace Environment URL | Managed: https://{your-domain}/e/{your-environment-id} | SaaS: https://{your-environment-id}.live.dynatrace.com
+    environment_url = endpoint["environment_url"]
+
+    # API Token with following permissions: 
+    # - Read problems
+    # - Write problems
+    # - Read metrics
+    # - Read entities
+    # - Read extensions
+    # - Read extension monitoring configurations
+    api_token = endpoint["api_token"]
+
+    # Text for fetching problems by problem text
+    problem_text = endpoint["problem_text"]
+
+    # Threshold for datapoint increase to define which extensions should be considered for analysis
+    datapoint_delta_threshold = endpoint["datapoint_delta_threshold"]
+
+    # Enable/disable verify SSL certificate for API requests
+    verify_ssl = endpoint["verify_ssl"]
+
+    # Hours between analysis window and comparison window (1 = last hour, 24 = yesterday, 168 = last week)
+    baseline_offset = timedelta(hours=endpoint.get("baseline_offset_hours", DEFAULT_BASELINE_OFFSET_HOURS))
+
+    # ================================================================================================
+    # ================================================================================================
+
+    # Monitor extension DDU consumption related problems
+    telemetry = Telemetry()
+    start_time = time.monotonic()
+    with collect(telemetry):
+        monitor_ddu_problems(logger, environment_url, api_token, problem_text, datapoint_delta_threshold, verify_ssl, deadline, baseline_offset, telemetry)
+    wall_time = time.monotonic() - start_time
+    logger.info(f"Analysis of endpoint {environment_url} took {wall_time:.2f}s.")
+
+    # Phase timings and API cost as self-monitoring metrics
+    dimensions = {"environment_url": environment_url}
+    metrics = [(f"{METRIC_PREFIX}.analysis.duration", wall_time, dimensions)]
+    metrics += [(key, value, {**dimensions, **metric_dimensions}) for key, value, metric_dimensions in telemetry.metrics()]
+
+    # ================================================================================================
+    # ================================================================================================
+
+    return metrics
+
+
+def monitor_ddu_problems(logger, environment_url, api_token, problem_text, datapoint_delta_threshold, verify_ssl, deadline=None, baseline_offset=timedelta(hours=DEFAULT_BASELINE_OFFSET_HOURS), telemetry=None):
+
+    if deadline is None:
+        deadline = Deadline(DEFAULT_ANALYSIS_TIMEOUT)
+
+    if telemetry is None:
+        telemetry = Telemetry()
+
+    try:
+        logger.info(f"Analyzing DDU problems for endpoint {environment_url} with problem text: {problem_text}.")
+
+        # Shared client with pooled connections for all API calls to this environment
+        client = get_client(environment_url, api_token, verify_ssl)
+
+        datetime_to = datetime.now(timezone.utc)
+
+        # Sample the minutes of the comparison window which are not stored locally yet,
+        # so comparison windows are answered locally instead of by the metrics API
+        baseline_store = get_baseline_store(environment_url, baseline_offset)
+        try:
+            with telemetry.phase("baseline_sampling"):
+                baseline_store.sample(client, datetime_to, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            telemetry.record_failure(type(e).__name__)
+            logger.warning(f"Could not sample baseline metrics for endpoint {environment_url}: {traceback.format_exc()}")
+
+        # Metric data is fetched once per cycle and shared by all problems
+        snapshot = MetricSnapshot(client, datetime_to, deadline, baseline_store, baseline_offset)
+
+        # Extension names and monitoring configuration scopes are cached across cycles
+        catalog = get_extension_catalog(client)
+
+        # Hosts of host groups and management zones, refreshed incrementally across cycles
+        scope_index = get_scope_index(client)
+
+        # Comments are posted in the background, report deliveries of earlier cycles which failed
+        outbox = get_comment_outbox(client, problem_text)
+        _log_delivery_failures(logger, environment_url, outbox, telemetry)
+
+        # Fetch DDU monitoring alert problems
+        # =================================================================================
+        problem_selector = f"status(open),text({problem_text})"
+
+        # Analyzed problems and the end of the last successful poll are kept in a local state file,
+        # the poll window starts shortly before the last successful poll so no problem is missed
+        problem_state = get_problem_state(environment_url, problem_text)
+        problem_time_from, problem_time_to = problem_state.poll_window(datetime_to.timestamp())
+
+        params = {
+            "pageSize": 50,
+            "from": problem_time_from, 
+            "to": problem_time_to, 
+            "problemSelector": problem_selector
+        }
+
+        # Without local state, take over problems already commented by earlier versions of this extension
+        if not problem_state.initialized:
+            params["fields"] = "recentComments"
+
+        # Problems are analyzed page by page while further pages are fetched in the background
+        problems = telemetry.timed("problem_fetch", client.iter_items("/api/v2/problems", "problems", params, deadline))
+        problem_count = 0
+
+        # Start root cause analysis of DDU spike for each problem
+        # =================================================================================
+        for problem in problems:
+            problem_count += 1
+
+            deadline.check()
+
+            problem_id = problem["problemId"]
+
+            if not problem_state.initialized and problem["recentComments"]["totalCount"] > 0:
+                problem_state.mark_analyzed(problem_id)
+
+            # Check if problem has already been analyzed and commented
+            if outbox.is_pending(problem_id):
+                logger.info(f"Comment for problem with ID {problem_id} is still being delivered.")
+
+            elif not problem_state.is_analyzed(problem_id):
+
+                logger.info(f"Analyzing problem with ID: {problem_id}.")
+
+                # Get set of extension names
+                # =================================================================================
+                with telemetry.phase("extension_listing"):
+                    extension_names = catalog.extension_names(deadline)
+
+                # Collect extensions where delta of ingested data points per extension config between
+                # current period and baseline period exceeds the defined threshold (shared by all problems of this cycle)
+                # =================================================================================
+                with telemetry.phase("metric_snapshot"):
+                    ingest_deltas = snapshot.ingest_deltas()
+                    ddu_deltas = snapshot.ddu_deltas()
+
+                extensions = [
+                    ExtensionConsumption(extension_name, config_id, current, previous)
+                    for (extension_name, config_id), current, previous, delta
+                    in ingest_deltas.select(datapoint_delta_threshold, accept=lambda key: key[0] in extension_names) # source contains extension name
+                ]
+
+                logger.info(f"Found {len(extensions)} extensions which exceed the specified threshold of {datapoint_delta_threshold} for datapoints increase.")
+
+                # Collect host entities with an increase of billed DDUs
+                # =================================================================================
+                host_ddu_deltas = ddu_deltas.deltas_above(0)
+
+                # Determine extensions where data point increase was billable
+                # =================================================================================
+                with telemetry.phase("scope_resolution"):
+                    scopes = resolve_scopes(extensions, catalog, scope_index, deadline)
+
+                with telemetry.phase("attribution"):
+                    bill_affecting_extensions = attribute(scopes, host_ddu_deltas)
+
+                # Queue comment with analysis result, it is posted in the background and the problem
+                # is marked as analyzed once the comment has been delivered
+                # =================================================================================
+                header = "DDU root cause analysis: \n"
+
+                if len(bill_affecting_extensions) > 0:
+                    logger.info(f"Detected {len(bill_affecting_extensions)} bill-affecting extensions.")
+
+                    entries = [
+                        f"Extension: {ext.extension_name} \nConfig ID: {ext.config_id} \nData point increase: {ext.delta()} \nEstimated DDU increase: {ext.estimated_ddus:.3f} \nAffected Entities: {', '.join(ext.affected_entities)} \n====================\n"
+                        for ext in bill_affecting_extensions
+                    ]
+
+                else:
+                    logger.info("No bill-affecting extensions were detected.")
+
+                    entries = ["No bill-affecting extensions were detected."]
+
+                with telemetry.phase("comment_posting"):
+                    outbox.submit(problem_id, split_message(header, entries), problem_state.mark_analyzed)
+
+                logger.info(f"Queued comment with analysis result for problem {problem_id}.")
+
+            else:
+                logger.info(f"Problem with ID {problem_id} has already been analyzed.")
+
+        # All problems of the poll window have been handled
+        problem_state.advance(problem_time_to)
+
+        # Give queued comments the rest of the deadline, undelivered ones are posted while the next cycle runs
+        with telemetry.phase("comment_delivery"):
+            pending_comments = outbox.flush(deadline.remaining())
+
+        # API calls of comment deliveries since the previous cycle, including deliveries which outlived it
+        telemetry.merge(outbox.telemetry.drain())
+        if pending_comments > 0:
+            logger.info(f"{pending_comments} comments for {environment_url} are still being delivered.")
+        _log_delivery_failures(logger, environment_url, outbox, telemetry)
+
+        logger.info(f"Number of detected problems for analysis: {problem_count}.")
+        logger.info(f"Metric snapshot for {environment_url}: {snapshot.queries} metric queries ({snapshot.local_baselines} baselines from local store), {snapshot.hits} datasets served from cache.")
+
+        scope_stats = catalog.stats()["scopes"]
+        logger.info(f"Scope cache for {environment_url}: {scope_stats['size']} entries, hit rate {scope_stats['hit_rate']:.0%}.")
+
+        # Failed background refreshes keep serving the stale value until it expires
+        for key, e in catalog.take_refresh_failures():
+            telemetry.record_failure(f"CacheRefresh{type(e).__name__}")
+            logger.warning(f"Could not refresh cached {key} of endpoint {environment_url}: {e}")
+        logger.info(f"Finished analysis of DDU problems.")    
+
+    except DeadlineExceeded:
+        telemetry.record_failure("DeadlineExceeded")
+        logger.warning(f"Stopped analysis of DDU problems for endpoint {environment_url}, deadline of {deadline.seconds}s exceeded.")
+
+    except requests.RequestException as e:
+        telemetry.record_failure(type(e).__name__)
+        logger.error(f"API request failed while monitoring DDU problems for endpoint {environment_url}: {e}")
+
+    except Exception as e:
+        telemetry.record_failure(type(e).__name__)
+        logger.error(f"Error while monitoring DDU problems for endpoint {environment_url}.")
+        logger.error(traceback.format_exc())
+
+def _log_delivery_failures(logger, environment_url, outbox, telemetry):
+    # Problems of failed deliveries are not marked as analyzed, so they are analyzed and queued again
+    for problem_id, e in outbox.take_failures():
+        telemetry.record_failure(f"CommentDelivery{type(e).__name__}")
+        logger.warning(f"Could not post comment to problem {problem_id} of endpoint {environment_url}: {e}")
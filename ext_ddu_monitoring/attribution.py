@@ -0,0 +1,84 @@
+from ext_ddu_monitoring.scopes import MANAGEMENT_ZONE_PREFIX
+
+# Estimated DDUs billed per ingested data point of an extension running on an ActiveGate
+DDU_PER_DATAPOINT = 0.001
+
+
+def is_host_scope(scope):
+    """
+    True for scopes of OneAgent extensions (host, host group or management zone), false for ActiveGate scopes
+    """
+    return scope.startswith("HOST") or scope.startswith(MANAGEMENT_ZONE_PREFIX)
+
+
+def resolve_scopes(extensions, catalog, scope_index, deadline=None):
+    """
+    Groups extension configurations by their monitoring configuration scope and resolves every distinct
+    scope to its hosts once. Returns a dict of scope to (extensions, host IDs), host IDs are None for ActiveGate scopes.
+    """
+    scopes = {}
+    for ext in extensions:
+        if deadline is not None:
+            deadline.check()
+
+        scope = catalog.scope(ext.extension_name, ext.config_id, deadline)
+        entry = scopes.get(scope)
+        if entry is None:
+            hosts = scope_index.hosts(scope, deadline) if is_host_scope(scope) else None
+            entry = scopes[scope] = ([], hosts)
+        entry[0].append(ext)
+
+    return scopes
+
+
+def attribute(scopes, host_ddu_deltas):
+    """
+    Returns the bill-affecting extension configurations, ranked by their estimated DDU increase.
+
+    The DDU increase of every host is split among all configurations running on it, proportionally
+    to their increase of ingested data points. Hosts are indexed by the scopes covering them instead
+    of by configuration, so configurations sharing a scope cost one pass over its hosts in total.
+    ActiveGate configurations are assumed to be billable with DDU_PER_DATAPOINT.
+    """
+    billable_hosts = set(host_ddu_deltas)
+
+    # Inverted index: data point increase of all configurations covering a host
+    billable_hosts_by_scope = {}
+    weight_by_host = {}
+
+    for scope, (extensions, hosts) in scopes.items():
+        if hosts is None:
+            continue
+
+        scope_hosts = sorted(hosts & billable_hosts)
+        if not scope_hosts:
+            continue
+
+        billable_hosts_by_scope[scope] = scope_hosts
+        weight = sum(max(ext.delta(), 0.0) for ext in extensions)
+        for host in scope_hosts:
+            weight_by_host[host] = weight_by_host.get(host, 0.0) + weight
+
+    bill_affecting_extensions = []
+
+    for scope, (extensions, hosts) in scopes.items():
+        if hosts is None:
+            for ext in extensions:
+                ext.estimated_ddus = ext.delta() * DDU_PER_DATAPOINT
+                bill_affecting_extensions.append(ext)
+            continue
+
+        scope_hosts = billable_hosts_by_scope.get(scope)
+        if scope_hosts is None:
+            continue
+
+        # DDU increase of the scope's hosts per data point of increase of the configurations running on them
+        ddus_per_datapoint = sum(host_ddu_deltas[host] / weight_by_host[host] for host in scope_hosts if weight_by_host[host] > 0)
+
+        for ext in extensions:
+            ext.affected_entities = scope_hosts
+            ext.estimated_ddus = max(ext.delta(), 0.0) * ddus_per_datapoint
+            bill_affecting_extensions.append(ext)
+
+    bill_affecting_extensions.sort(key=lambda ext: (ext.estimated_ddus, ext.delta()), reverse=True)
+    return bill_affecting_extensions
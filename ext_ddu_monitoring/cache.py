@@ -0,0 +1,104 @@
+import threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Background refreshes of stale cache entries
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ddu_cache_refresh")
+
+
+class _Entry:
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.expires_at = time.monotonic() + ttl
+        self.refreshing = False
+
+
+class TTLCache:
+    """
+    Bounded cache with time-to-live and least-recently-used eviction.
+
+    Expired entries are still served for another TTL period while they are reloaded in the
+    background, so callers only wait for the API on keys which have never been loaded.
+    Loaders are called with the deadline of the caller, or None when refreshed in the background.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+        self._failed_refreshes = []
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, deadline=None):
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and now < entry.expires_at + self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+                # Serve stale value and revalidate it in the background
+                if now >= entry.expires_at and not entry.refreshing:
+                    entry.refreshing = True
+                    _refresh_executor.submit(self._refresh, key, loader, entry)
+
+                return entry.value
+
+            self.misses += 1
+
+        value = loader(deadline)
+        self._put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+            }
+
+    def take_refresh_failures(self):
+        """
+        Returns and clears (key, exception) of all background refreshes which failed
+        """
+        with self._lock:
+            failures, self._failed_refreshes = self._failed_refreshes, []
+            return failures
+
+    def _refresh(self, key, loader, entry):
+        try:
+            self._put(key, loader(None))
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self.refresh_failures += 1
+                self._failed_refreshes.append((key, e))
+        finally:
+            # Allow another attempt if the refresh failed
+            entry.refreshing = False
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = _Entry(value, self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
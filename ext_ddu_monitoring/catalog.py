@@ -0,0 +1,69 @@
+import threading
+
+from ext_ddu_monitoring.cache import TTLCache
+
+# Extensions are rarely installed or removed, monitoring configuration scopes change even less
+EXTENSION_NAMES_TTL = 10 * 60
+SCOPES_TTL = 30 * 60
+
+# Maximum number of monitoring configuration scopes kept per environment
+MAX_CACHED_SCOPES = 10000
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_extension_catalog(client):
+    """
+    Returns the extension catalog of the client's environment, which is kept across cycles
+    """
+    with _catalogs_lock:
+        catalog = _catalogs.get(client.environment_url)
+        if catalog is None:
+            catalog = _catalogs[client.environment_url] = ExtensionCatalog(client)
+        catalog.client = client
+        return catalog
+
+
+class ExtensionCatalog:
+    """
+    Cached extension names and monitoring configuration scopes of an environment
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._extension_names = TTLCache(EXTENSION_NAMES_TTL, 1)
+        self._scopes = TTLCache(SCOPES_TTL, MAX_CACHED_SCOPES)
+
+    def extension_names(self, deadline=None):
+        return self._extension_names.get("extension_names", self._load_extension_names, deadline)
+
+    def scope(self, extension_name, config_id, deadline=None):
+        return self._scopes.get(
+            (extension_name, config_id),
+            lambda loader_deadline: self._load_scope(extension_name, config_id, loader_deadline),
+            deadline
+        )
+
+    def stats(self):
+        return {
+            "extension_names": self._extension_names.stats(),
+            "scopes": self._scopes.stats(),
+        }
+
+    def take_refresh_failures(self):
+        """
+        Returns and clears (cache key, exception) of all failed background refreshes
+        """
+        return self._extension_names.take_refresh_failures() + self._scopes.take_refresh_failures()
+
+    def _load_extension_names(self, deadline):
+        params = {
+            "pageSize": 100
+        }
+        extensions = self.client.iter_items("/api/v2/extensions", "extensions", params, deadline)
+        return frozenset(ext["extensionName"] for ext in extensions)
+
+    def _load_scope(self, extension_name, config_id, deadline):
+        monitoring_configuration_api = f"/api/v2/extensions/{extension_name}/monitoringConfigurations/{config_id}"
+        return self.client.get(monitoring_configuration_api, deadline=deadline)["scope"]
@@ -0,0 +1,259 @@
+import codecs, contextvars, queue, random, threading, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from ext_ddu_monitoring.deadline import DeadlineExceeded
+from ext_ddu_monitoring.telemetry import current_telemetry, endpoint_name
+
+# Timeouts in seconds for establishing a connection and for waiting on a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Retries of failed requests with exponential backoff (base * 2^attempt, capped, with full jitter)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Requests which may have been processed by the server are only retried for idempotent methods,
+# otherwise a timed out POST whose comment was stored would post it twice
+IDEMPOTENT_METHODS = {"GET"}
+NON_IDEMPOTENT_RETRY_STATUS_CODES = {429}
+
+# Maximum number of requests sent to the same environment at the same time
+MAX_CONCURRENT_REQUESTS = 4
+
+# Maximum number of pages fetched ahead of the consumer during pagination
+MAX_BUFFERED_PAGES = 2
+
+# Size in bytes of the chunks in which streamed responses are read
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Marks the end of a pagination in the page buffer
+_END_OF_PAGES = object()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(environment_url, api_token, verify_ssl):
+    """
+    Returns the shared client for an environment, so connections are kept alive across cycles
+    """
+    key = (environment_url, api_token, verify_ssl)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = DynatraceClient(environment_url, api_token, verify_ssl)
+        return client
+
+
+class DynatraceClient:
+    """
+    Client for the Dynatrace API v2 of a single environment.
+
+    Keeps a keep-alive connection pool, authenticates via the Authorization header,
+    retries throttled and failed requests and limits the number of concurrent requests.
+    """
+
+    def __init__(self, environment_url, api_token, verify_ssl):
+        self.environment_url = environment_url.rstrip("/")
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Api-Token {api_token}"
+        self.session.verify = verify_ssl
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+    def get(self, path, params=None, deadline=None):
+        return self.request("GET", path, deadline, params=params).json()
+
+    def post(self, path, json=None, deadline=None):
+        response = self.request("POST", path, deadline, json=json)
+        return response.json() if response.content else None
+
+    @contextmanager
+    def stream(self, path, params=None, deadline=None):
+        """
+        Sends a GET request and provides the response body as iterator of text chunks.
+
+        The body is read from the connection while the chunks are consumed instead of being
+        loaded into memory at once. The connection is released when the block is left.
+        """
+        response = self.request("GET", path, deadline, params=params, stream=True)
+        try:
+            yield self._iter_text(response, endpoint_name("GET", path), deadline)
+        finally:
+            response.close()
+
+    def paginate(self, path, params=None, deadline=None, max_buffered_pages=MAX_BUFFERED_PAGES):
+        """
+        Yields all pages of a list endpoint by following nextPageKey.
+
+        The next page is fetched in the background while the consumer works on the current one,
+        holding at most max_buffered_pages pages in memory.
+        """
+        pages = queue.Queue(maxsize=max_buffered_pages)
+        stopped = threading.Event()
+
+        def put(item):
+            # Give up once the consumer stopped reading, otherwise the thread blocks forever
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch_pages():
+            page_params = params
+            try:
+                while True:
+                    page = self.get(path, page_params, deadline)
+                    if not put(page):
+                        return
+
+                    next_page_key = page.get("nextPageKey")
+                    if not next_page_key:
+                        break
+
+                    # Follow-up requests must not contain any other query parameter
+                    page_params = {"nextPageKey": next_page_key}
+
+            except Exception as e:
+                put(e)
+                return
+
+            put(_END_OF_PAGES)
+
+        # Run in the caller's context, so API calls are recorded in the caller's telemetry
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(fetch_pages,), name="ddu_pagination", daemon=True).start()
+
+        try:
+            while True:
+                page = pages.get()
+                if page is _END_OF_PAGES:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stopped.set()
+
+    def iter_items(self, path, items_key, params=None, deadline=None):
+        """
+        Yields the items of all pages of a list endpoint, e.g. the "problems" of /api/v2/problems
+        """
+        for page in self.paginate(path, params, deadline):
+            yield from page.get(items_key, [])
+
+    def request(self, method, path, deadline=None, **kwargs):
+        """
+        Sends a request and retries it on connection errors, 429 and 5xx responses.
+        Non-idempotent requests are only retried on 429 and if the connection could not be established.
+        Raises requests.HTTPError if the final response is not successful.
+        """
+        url = self.environment_url + path
+        telemetry = current_telemetry()
+        endpoint = endpoint_name(method, path)
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRY_STATUS_CODES
+
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+
+            if attempt > 0 and telemetry is not None:
+                telemetry.record_retry(endpoint)
+
+            try:
+                with self._semaphore:
+                    response = self.session.request(method, url, timeout=self._timeout(deadline), **kwargs)
+
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if telemetry is not None:
+                    telemetry.record_error(endpoint)
+                if last_attempt or not (idempotent or self._not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+
+            else:
+                if telemetry is not None:
+                    # Streamed bodies are counted while they are read
+                    telemetry.record_call(endpoint, 0 if kwargs.get("stream") else len(response.content))
+                    if response.status_code >= 400:
+                        telemetry.record_error(endpoint)
+
+                if response.status_code not in retry_status_codes or last_attempt:
+                    if response.status_code >= 400:
+                        # Release the connection of a streamed response before raising
+                        response.close()
+                    response.raise_for_status()
+                    return response
+
+                delay = self._retry_after(response)
+                response.close()
+                if delay is None:
+                    delay = self._backoff(attempt)
+
+            if deadline is not None and delay >= deadline.remaining():
+                raise DeadlineExceeded(f"Deadline of {deadline.seconds}s exceeded while waiting to retry {method} {path}")
+
+            time.sleep(delay)
+
+    def _iter_text(self, response, endpoint, deadline):
+        telemetry = current_telemetry()
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if deadline is not None:
+                deadline.check()
+            if telemetry is not None:
+                telemetry.record_response_bytes(endpoint, len(chunk))
+            yield decoder.decode(chunk)
+
+        yield decoder.decode(b"", final=True)
+
+    def _timeout(self, deadline):
+        if deadline is None:
+            return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        deadline.check()
+        remaining = deadline.remaining()
+        return (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+
+    def _not_sent(self, error):
+        # Connect timeouts and refused connections fail before any byte of the request is sent
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _retry_after(self, response):
+        # Retry-After is either a number of seconds or an HTTP date
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
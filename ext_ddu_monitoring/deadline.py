@@ -0,0 +1,40 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the analysis of an endpoint runs out of time
+    """
+
+
+class Deadline:
+    """
+    Point in time until which the analysis of an endpoint has to be finished.
+
+    Threads cannot be interrupted from outside, so long running steps call check() between
+    API calls and stop by raising DeadlineExceeded once the time is up.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def at(cls, timestamp, seconds):
+        """
+        Returns a deadline of seconds in total which expires at a wall-clock timestamp.
+        Used to pass deadlines to other processes, which measure from when they pick them up otherwise.
+        """
+        deadline = cls(seconds)
+        deadline.expires_at = time.monotonic() + max(0.0, timestamp - time.time())
+        return deadline
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.seconds}s exceeded")
@@ -0,0 +1,123 @@
+import json
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Incremental reader of a JSON document delivered in text chunks.
+
+    The structure of the document is walked with iter_object() and iter_array(), while
+    values are decoded one at a time with value(). Only the unread rest of the current
+    chunk is held in memory, so large arrays can be processed element by element.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def value(self):
+        """
+        Decodes and returns the next value
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+
+            # A number followed by nothing but number characters may continue in the next chunk
+            if self._complete(value, end) or not self._fill():
+                self._pos = end
+                return value
+
+    def iter_object(self):
+        """
+        Yields the keys of the next object. The value of each key must be consumed before the next key is read.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+
+            if self._next_separator("}"):
+                return
+
+    def iter_array(self):
+        """
+        Yields the indexes of the next array. Each element must be consumed before the next index is read.
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+
+        index = 0
+        while True:
+            yield index
+            index += 1
+
+            if self._next_separator("]"):
+                return
+
+    def _next_separator(self, closing):
+        char = self._peek()
+        self._pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise ValueError(f"Expected ',' or '{closing}' in JSON stream, got {char!r}")
+        return False
+
+    def _complete(self, value, end):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return True
+        return end < len(self._buffer) and self._buffer[end] not in _NUMBER_CHARS
+
+    def _expect(self, expected):
+        char = self._peek()
+        if char != expected:
+            raise ValueError(f"Expected {expected!r} in JSON stream, got {char!r}")
+        self._pos += 1
+
+    def _peek(self):
+        self._skip_whitespace()
+        return self._buffer[self._pos]
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def _fill(self):
+        """
+        Appends the next chunk to the unread rest of the buffer, returns False at the end of the document
+        """
+        if self._eof:
+            return False
+
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                return True
+
+        self._eof = True
+        return False
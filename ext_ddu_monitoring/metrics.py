@@ -0,0 +1,76 @@
+from ext_ddu_monitoring.jsonstream import JsonStream
+
+# Ingested metric data points split by extension (source) and extension config
+INGEST_SERIES = "dsfm:server.metrics.ingest.external_datapoints:splitBy(source,\"dt.extension.config.id\")"
+
+# Billed DDUs per host entity
+DDU_BY_HOST_SERIES = "builtin:billing.ddu.metrics.byEntity:filter(in(\"dt.entity.monitored_entity\", entitySelector(\"type(~\"HOST~\")\"))):splitBy(\"dt.entity.monitored_entity\")"
+
+
+def folded(series_selector):
+    """
+    Returns the selector summing up each series over the whole timeframe
+    """
+    return series_selector + ":sort(value(auto,descending)):fold(sum)"
+
+
+def ingest_key(dimension_map):
+    return (dimension_map["source"], dimension_map["dt.extension.config.id"])
+
+
+def host_key(dimension_map):
+    return dimension_map["dt.entity.monitored_entity"]
+
+
+def timeshifted(series_selector, offset):
+    """
+    Returns the selector delivering the values of `offset` (timedelta) earlier for the queried timeframe
+    """
+    return f"{series_selector}:timeshift(-{int(offset.total_seconds() // 60)}m)"
+
+
+def iter_results(client, metric_selectors, time_from, time_to, deadline=None, resolution=None):
+    """
+    Queries several metric selectors with a single request and yields (selector index, series data)
+    of all series returned, following nextPageKey.
+
+    Responses are parsed while they are streamed, so only a single series is held in memory
+    at a time instead of whole pages of up to 10000 series.
+    """
+    params = {
+        "metricSelector": ",".join(metric_selectors),
+        "from": time_from,
+        "to": time_to,
+        "pageSize": 10000
+    }
+    if resolution:
+        params["resolution"] = resolution
+
+    while params:
+        page = {}
+        with client.stream("/api/v2/metrics/query", params, deadline) as chunks:
+            yield from _iter_page(JsonStream(chunks), page)
+
+        # Follow-up requests must not contain any other query parameter
+        next_page_key = page.get("nextPageKey")
+        params = {"nextPageKey": next_page_key} if next_page_key else None
+
+
+def _iter_page(stream, page):
+    """
+    Yields (result index, series data) of a metrics query response and collects all other top-level fields in page
+    """
+    for key in stream.iter_object():
+        if key != "result":
+            page[key] = stream.value()
+            continue
+
+        # Results are returned in the order of the selectors
+        for index in stream.iter_array():
+            for result_key in stream.iter_object():
+                if result_key != "data":
+                    stream.value()
+                    continue
+
+                for _ in stream.iter_array():
+                    yield index, stream.value()
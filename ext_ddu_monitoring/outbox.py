@@ -0,0 +1,204 @@
+import hashlib, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ext_ddu_monitoring.state import ANALYZED_RETENTION
+from ext_ddu_monitoring.storage import state_file
+from ext_ddu_monitoring.telemetry import Telemetry, collect
+
+# Maximum length of a single problem comment, longer reports are posted as several comments
+MAX_COMMENT_LENGTH = 4000
+
+# Maximum number of comments posted for the same endpoint at the same time
+MAX_CONCURRENT_WRITES = 2
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_comment_outbox(client, problem_text):
+    """
+    Returns the comment outbox of an endpoint, which is kept across cycles. Endpoints of the same environment
+    with different problem texts may match the same problem, each of them comments it with its own report.
+    """
+    key = (client.environment_url, problem_text)
+    with _outboxes_lock:
+        outbox = _outboxes.get(key)
+        if outbox is None:
+            text_id = hashlib.sha256(problem_text.encode("utf-8")).hexdigest()[:16]
+            outbox = _outboxes[key] = CommentOutbox(client, state_file(client.environment_url, f"comments_{text_id}.json"))
+        outbox.client = client
+        return outbox
+
+
+def close_comment_outboxes():
+    """
+    Waits for the comments being posted and drops all outboxes, queued reports which have not started are discarded.
+    Outboxes are loaded from their files again when used next.
+    """
+    with _outboxes_lock:
+        outboxes = list(_outboxes.values())
+        _outboxes.clear()
+
+    for outbox in outboxes:
+        outbox.close()
+
+
+def split_message(header, entries, max_length=MAX_COMMENT_LENGTH):
+    """
+    Joins the entries of a report to messages of at most max_length characters, each starting with the header.
+    Messages are only split between entries, unless a single entry exceeds the limit.
+    """
+    # Room for the " (part i/n)" marker added to the header
+    room = max_length - len(header) - 16
+
+    parts = []
+    current = ""
+    for entry in entries:
+        while len(entry) > room:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(entry[:room])
+            entry = entry[room:]
+
+        if len(current) + len(entry) > room:
+            parts.append(current)
+            current = ""
+        current += entry
+
+    if current or not parts:
+        parts.append(current)
+
+    if len(parts) == 1:
+        return [header + parts[0]]
+
+    title, newline, rest = header.partition("\n")
+    return [f"{title.rstrip()} (part {number}/{len(parts)}) {newline}{rest}{part}" for number, part in enumerate(parts, 1)]
+
+
+class CommentOutbox:
+    """
+    Posts problem comments in the background, so the analysis does not wait for the API.
+
+    Comments are delivered with bounded concurrency, failed requests are retried by the client.
+    Before the first part of a report is posted, the report is kept in a local state file together
+    with the parts attempted and delivered. A problem which is submitted again after a failed or
+    interrupted delivery only gets the remaining parts of that report, so it never receives a
+    second report. A part whose attempt failed after it may have been stored is only posted again
+    if the problem's comments do not contain it.
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+        # Deliveries may finish after the cycle which queued them has reported its metrics,
+        # so their API calls are collected here and drained by the cycle running at that time
+        self.telemetry = Telemetry()
+
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WRITES, thread_name_prefix="ddu_comments")
+        self._pending = {}
+        self._failures = []
+        self._reports = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def submit(self, problem_id, messages, on_delivered=None):
+        """
+        Queues the messages of a report for a problem, on_delivered(problem_id) is called once all of them are posted
+        """
+        with self._lock:
+            future = self._pending[problem_id] = self._executor.submit(self._deliver, problem_id, messages, on_delivered)
+        future.add_done_callback(lambda future: self._done(problem_id, future))
+        return future
+
+    def is_pending(self, problem_id):
+        with self._lock:
+            return problem_id in self._pending
+
+    def flush(self, timeout=None):
+        """
+        Waits up to timeout seconds for all queued reports, returns the number of reports still pending
+        """
+        with self._lock:
+            futures = list(self._pending.values())
+        _, not_done = wait(futures, timeout)
+        return len(not_done)
+
+    def take_failures(self):
+        """
+        Returns and clears (problem ID, exception) of all failed deliveries
+        """
+        with self._lock:
+            failures, self._failures = self._failures, []
+            return failures
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _deliver(self, problem_id, messages, on_delivered):
+        with collect(self.telemetry):
+            self._post_messages(problem_id, messages)
+
+        if on_delivered is not None:
+            on_delivered(problem_id)
+
+    def _post_messages(self, problem_id, messages):
+        path = f"/api/v2/problems/{problem_id}/comments"
+
+        # A report analyzed again after an interrupted delivery may differ in its values and number of parts,
+        # so the report stored before its first part was sent is completed instead
+        with self._lock:
+            report = self._reports.get(problem_id)
+            if report is None:
+                report = self._reports[problem_id] = {"messages": messages, "attempted": [], "delivered": [], "time": time.time()}
+            messages = report.get("messages", [])
+
+        for number, message in enumerate(messages, 1):
+            if number in report["delivered"]:
+                continue
+
+            # A failed attempt may have stored the comment, e.g. when the response timed out
+            if number not in report["attempted"] or not self._has_comment(path, message):
+                with self._lock:
+                    if number not in report["attempted"]:
+                        report["attempted"].append(number)
+                    report["time"] = time.time()
+                    self._save()
+
+                self.client.post(path, {"message": message})
+
+            with self._lock:
+                report["delivered"].append(number)
+                report["time"] = time.time()
+
+                # Messages are only kept until all parts are delivered
+                if len(report["delivered"]) == len(messages):
+                    del report["messages"]
+                self._save()
+
+    def _has_comment(self, path, message):
+        return any(comment["content"] == message for comment in self.client.iter_items(path, "comments", {"pageSize": 500}))
+
+    def _done(self, problem_id, future):
+        with self._lock:
+            if self._pending.get(problem_id) is future:
+                del self._pending[problem_id]
+            if future.exception() is not None:
+                self._failures.append((problem_id, future.exception()))
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._reports = json.load(f)
+        except (OSError, ValueError):
+            return
+
+    def _save(self):
+        forget_before = time.time() - ANALYZED_RETENTION
+        self._reports = {problem_id: report for problem_id, report in self._reports.items() if report["time"] >= forget_before}
+
+        tmp_path = str(self.path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._reports, f)
+        os.replace(tmp_path, self.path)
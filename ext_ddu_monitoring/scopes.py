@@ -0,0 +1,129 @@
+import threading, time
+
+MANAGEMENT_ZONE_PREFIX = "management_zone-"
+
+# Minimum time in seconds between two refreshes of the index, every refresh loads all hosts alive since the previous one
+REFRESH_INTERVAL = 10 * 60
+
+# Hosts seen within this time in seconds are loaded when the index is built
+INITIAL_LOOKBACK = 2 * 60 * 60
+
+# Refreshes reach back this many seconds before the previous refresh, so late updates are not missed
+REFRESH_OVERLAP = 5 * 60
+
+# Hosts which have not been seen for this time in seconds are removed from the index
+HOST_RETENTION = 2 * 60 * 60
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_scope_index(client):
+    """
+    Returns the scope index of the client's environment, which is kept across cycles
+    """
+    with _indexes_lock:
+        index = _indexes.get(client.environment_url)
+        if index is None:
+            index = _indexes[client.environment_url] = ScopeIndex(client)
+        index.client = client
+        return index
+
+
+class ScopeIndex:
+    """
+    Host membership of the host groups and management zones of an environment.
+
+    Maps every scope to the hosts it contains and every host to the scopes it belongs to.
+    The index is built with a single entity query on first use and refreshed with a query
+    for the hosts seen since the previous refresh. The entities API cannot filter hosts by
+    changes, so every refresh downloads all hosts which are still alive; refreshes are
+    therefore rare, and hosts which are no longer returned expire after HOST_RETENTION.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+        self._hosts_by_scope = {}
+        self._scopes_by_host = {}
+        self._last_seen_by_host = {}
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def hosts(self, scope, deadline=None):
+        """
+        Returns the host IDs of a HOST, HOST_GROUP or management zone scope
+        """
+        if scope.startswith("HOST-"):
+            return {scope}
+
+        self.refresh(deadline)
+        with self._lock:
+            return set(self._hosts_by_scope.get(scope, ()))
+
+    def scopes(self, host_id, deadline=None):
+        """
+        Returns the host group and management zone scopes a host belongs to
+        """
+        self.refresh(deadline)
+        with self._lock:
+            return set(self._scopes_by_host.get(host_id, ()))
+
+    def refresh(self, deadline=None):
+        # Concurrent callers wait for a running refresh instead of querying the same hosts again
+        with self._refresh_lock:
+            now = time.time()
+
+            if self._last_refresh is not None and now - self._last_refresh < REFRESH_INTERVAL:
+                return
+
+            if self._last_refresh is None:
+                refresh_from = now - INITIAL_LOOKBACK
+            else:
+                refresh_from = self._last_refresh - REFRESH_OVERLAP
+
+            params = {
+                "pageSize": 500,
+                "from": int(refresh_from * 1000),
+                "to": int(now * 1000),
+                "entitySelector": "type(HOST)",
+                "fields": "+lastSeenTms,+fromRelationships.isInstanceOf,+managementZones",
+            }
+            hosts = list(self.client.iter_items("/api/v2/entities", "entities", params, deadline))
+
+            with self._lock:
+                for host in hosts:
+                    self._update_host(host)
+
+                self._remove_hosts_seen_before((now - HOST_RETENTION) * 1000)
+                self._last_refresh = now
+
+    def _update_host(self, host):
+        host_id = host["entityId"]
+
+        scopes = set()
+        for relation in host.get("fromRelationships", {}).get("isInstanceOf", []):
+            if relation.get("type") == "HOST_GROUP":
+                scopes.add(relation["id"])
+        for management_zone in host.get("managementZones", []):
+            scopes.add(MANAGEMENT_ZONE_PREFIX + management_zone["name"])
+
+        self._remove_host(host_id)
+
+        self._scopes_by_host[host_id] = scopes
+        self._last_seen_by_host[host_id] = host.get("lastSeenTms", time.time() * 1000)
+        for scope in scopes:
+            self._hosts_by_scope.setdefault(scope, set()).add(host_id)
+
+    def _remove_hosts_seen_before(self, timestamp):
+        for host_id in [host_id for host_id, last_seen in self._last_seen_by_host.items() if last_seen < timestamp]:
+            self._remove_host(host_id)
+
+    def _remove_host(self, host_id):
+        for scope in self._scopes_by_host.pop(host_id, ()):
+            scope_hosts = self._hosts_by_scope[scope]
+            scope_hosts.discard(host_id)
+            if not scope_hosts:
+                del self._hosts_by_scope[scope]
+        self._last_seen_by_host.pop(host_id, None)
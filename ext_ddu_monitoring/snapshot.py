@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+from ext_ddu_monitoring.aggregation import DeltaTable
+from ext_ddu_monitoring.metrics import INGEST_SERIES, DDU_BY_HOST_SERIES, folded, timeshifted, ingest_key, host_key, iter_results
+
+
+class MetricSnapshot:
+    """
+    Metric data of one endpoint for a single query() cycle.
+
+    All problems analyzed within a cycle share the same analysis window, so every dataset
+    is loaded once on first access and served from memory for the remaining problems.
+    Datasets are lists of (series key, value) pairs. The current and baseline windows of
+    both metrics are loaded together with one multi-selector metrics query. The baseline
+    is taken from the local baseline store when it covers the shifted window, otherwise
+    it is queried as timeshifted selector within the same request.
+    """
+
+    def __init__(self, client, datetime_to, deadline=None, baseline_store=None, baseline_offset=timedelta(hours=1)):
+        self.client = client
+        self.deadline = deadline
+        self.baseline_store = baseline_store
+        self.baseline_offset = baseline_offset
+
+        # Analysis window of the last 5 min and the same window shifted into the past for comparison
+        self.datetime_to = datetime_to
+        self.datetime_from = datetime_to - timedelta(minutes=5)
+        self.datetime_to_shifted = self.datetime_to - baseline_offset
+        self.datetime_from_shifted = self.datetime_from - baseline_offset
+
+        self.time_to = self.datetime_to.isoformat(timespec='milliseconds')
+        self.time_from = self.datetime_from.isoformat(timespec='milliseconds')
+        self.time_to_shifted = self.datetime_to_shifted.isoformat(timespec='milliseconds')
+        self.time_from_shifted = self.datetime_from_shifted.isoformat(timespec='milliseconds')
+
+        self.hits = 0
+        self.misses = 0
+        self.local_baselines = 0
+        self.queries = 0
+        self._data = {}
+        self._series = None
+
+    def current_ingest(self):
+        return self._get("current_ingest", lambda: self._load_series()["current_ingest"])
+
+    def previous_ingest(self):
+        return self._get("previous_ingest", lambda: self._load_series()["previous_ingest"])
+
+    def current_ddu_by_host(self):
+        return self._get("current_ddu_by_host", lambda: self._load_series()["current_ddu_by_host"])
+
+    def previous_ddu_by_host(self):
+        return self._get("previous_ddu_by_host", lambda: self._load_series()["previous_ddu_by_host"])
+
+    def ingest_deltas(self):
+        """
+        Returns a DeltaTable of ingested data points per (extension name, config id)
+        """
+        return self._get("ingest_deltas", lambda: DeltaTable(self.current_ingest(), self.previous_ingest()))
+
+    def ddu_deltas(self):
+        """
+        Returns a DeltaTable of billed DDUs per host entity
+        """
+        return self._get("ddu_deltas", lambda: DeltaTable(self.current_ddu_by_host(), self.previous_ddu_by_host()))
+
+    def _get(self, name, loader):
+        if name in self._data:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._data[name] = loader()
+        return self._data[name]
+
+    def _load_series(self):
+        """
+        Loads the current and baseline windows of both metrics with a single metrics query.
+
+        Baselines covered by the local baseline store are taken from there, all others are
+        queried as timeshifted selectors over the current window.
+        """
+        if self._series is not None:
+            return self._series
+        loaded = {}
+
+        datasets = [("current_ingest", folded(INGEST_SERIES), ingest_key), ("current_ddu_by_host", folded(DDU_BY_HOST_SERIES), host_key)]
+        for name, series_selector, key, local_loader in (
+            ("previous_ingest", INGEST_SERIES, ingest_key, lambda: self.baseline_store.baseline_ingest(self.datetime_to)),
+            ("previous_ddu_by_host", DDU_BY_HOST_SERIES, host_key, lambda: self.baseline_store.baseline_ddu_by_host(self.datetime_to)),
+        ):
+            baseline = local_loader() if self.baseline_store is not None else None
+            if baseline is not None:
+                self.local_baselines += 1
+                loaded[name] = list(baseline.items())
+            else:
+                datasets.append((name, folded(timeshifted(series_selector, self.baseline_offset)), key))
+
+        results = [[] for _ in datasets]
+        for index, series in iter_results(self.client, [selector for _, selector, _ in datasets], self.time_from, self.time_to, self.deadline):
+            results[index].append((datasets[index][2](series["dimensionMap"]), series["values"][0]))
+        self.queries += 1
+
+        for (name, _, _), result in zip(datasets, results):
+            loaded[name] = result
+        self._series = loaded
+        return loaded
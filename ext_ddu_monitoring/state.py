@@ -0,0 +1,119 @@
+import hashlib, json, os, threading, time
+
+from ext_ddu_monitoring.storage import state_file
+
+# Problems are polled from this many seconds before the previous poll, so late updates are not missed
+POLL_OVERLAP = 5 * 60
+
+# Timeframe in seconds of the first poll, and the longest timeframe after a longer downtime
+INITIAL_LOOKBACK = 10 * 60
+MAX_LOOKBACK = 6 * 60 * 60
+
+# Analyzed problems which have not been returned by a poll for this time in seconds are forgotten
+ANALYZED_RETENTION = 24 * 60 * 60
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def get_problem_state(environment_url, problem_text):
+    """
+    Returns the persisted problem state of an endpoint
+    """
+    key = (environment_url, problem_text)
+    with _states_lock:
+        state = _states.get(key)
+        if state is None:
+            text_id = hashlib.sha256(problem_text.encode("utf-8")).hexdigest()[:16]
+            state = _states[key] = ProblemState(state_file(environment_url, f"problems_{text_id}.json"))
+        return state
+
+
+def forget_problem_states():
+    """
+    Drops the problem states kept in memory, they are loaded from their files again when used next
+    """
+    with _states_lock:
+        _states.clear()
+
+
+class ProblemState:
+    """
+    IDs of analyzed problems and the high-watermark of the problem poll of an endpoint.
+
+    The state is written to a JSON file after every change, so a restart neither analyzes
+    problems again nor leaves a gap in the polled timeframe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self._analyzed = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def initialized(self):
+        """
+        False until the first poll has completed
+        """
+        return self.watermark is not None
+
+    def poll_window(self, now=None):
+        """
+        Returns (from, to) in epoch milliseconds for the next problem poll
+        """
+        now = now or time.time()
+        with self._lock:
+            if self.watermark is None:
+                poll_from = now - INITIAL_LOOKBACK
+            else:
+                poll_from = max(self.watermark / 1000 - POLL_OVERLAP, now - MAX_LOOKBACK)
+        return int(poll_from * 1000), int(now * 1000)
+
+    def is_analyzed(self, problem_id):
+        with self._lock:
+            self._seen[problem_id] = time.time()
+            return problem_id in self._analyzed
+
+    def mark_analyzed(self, problem_id):
+        with self._lock:
+            self._analyzed[problem_id] = self._seen[problem_id] = time.time()
+            self._save()
+
+    def advance(self, watermark):
+        """
+        Stores the end of a successfully completed poll and forgets problems which are no longer returned
+        """
+        with self._lock:
+            self.watermark = watermark
+
+            forget_before = time.time() - ANALYZED_RETENTION
+            for problem_id in [problem_id for problem_id, seen in self._seen.items() if seen < forget_before]:
+                del self._seen[problem_id]
+                self._analyzed.pop(problem_id, None)
+
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.watermark = state.get("watermark")
+        self._analyzed = state.get("analyzed", {})
+        self._seen = state.get("seen", {})
+
+    def _save(self):
+        state = {
+            "watermark": self.watermark,
+            "analyzed": self._analyzed,
+            "seen": {problem_id: self._seen[problem_id] for problem_id in self._analyzed if problem_id in self._seen},
+        }
+        tmp_path = str(self.path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,19 @@
+import hashlib, os, tempfile
+from pathlib import Path
+
+# Directory for state which has to survive restarts, can be overridden with this environment variable
+STATE_DIR_ENV = "EXT_DDU_MONITORING_STATE_DIR"
+
+
+def state_dir():
+    path = Path(os.environ.get(STATE_DIR_ENV) or Path(tempfile.gettempdir()) / "ext_ddu_monitoring")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def state_file(environment_url, name):
+    """
+    Returns the path of a state file for an environment, e.g. state_file(url, "baseline_ingest.bin")
+    """
+    environment_id = hashlib.sha256(environment_url.encode("utf-8")).hexdigest()[:16]
+    return state_dir() / f"{environment_id}_{name}"
@@ -0,0 +1,125 @@
+import contextvars, re, threading, time
+from contextlib import contextmanager
+
+# Prefix of all self-monitoring metric keys
+METRIC_PREFIX = "ddu_monitoring"
+
+_current = contextvars.ContextVar("ddu_monitoring_telemetry", default=None)
+
+# Path parameters are replaced, so calls are counted per API endpoint instead of per problem or config
+_ENDPOINT_PATTERNS = [
+    (re.compile(r"^/api/v2/problems/[^/]+/comments$"), "/api/v2/problems/{problemId}/comments"),
+    (re.compile(r"^/api/v2/extensions/[^/]+/monitoringConfigurations/[^/]+$"), "/api/v2/extensions/{extensionName}/monitoringConfigurations/{configurationId}"),
+]
+
+
+def current_telemetry():
+    """
+    Returns the telemetry of the analysis running in the current context, if any
+    """
+    return _current.get()
+
+
+@contextmanager
+def collect(telemetry):
+    """
+    Makes telemetry the target of all API calls recorded within the block
+    """
+    token = _current.set(telemetry)
+    try:
+        yield telemetry
+    finally:
+        _current.reset(token)
+
+
+def endpoint_name(method, path):
+    for pattern, template in _ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            return f"{method} {template}"
+    return f"{method} {path}"
+
+
+class Telemetry:
+    """
+    Phase timings and API cost of the analysis of one endpoint in one cycle
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.api_calls = {}
+        self.api_response_bytes = {}
+        self.api_retries = {}
+        self.api_errors = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self.phases, name, time.perf_counter() - start_time)
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of iterable, adding the time spent waiting for them to a phase
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_call(self, endpoint, response_bytes):
+        self._add(self.api_calls, endpoint, 1)
+        self._add(self.api_response_bytes, endpoint, response_bytes)
+
+    def record_response_bytes(self, endpoint, response_bytes):
+        self._add(self.api_response_bytes, endpoint, response_bytes)
+
+    def record_retry(self, endpoint):
+        self._add(self.api_retries, endpoint, 1)
+
+    def record_error(self, endpoint):
+        self._add(self.api_errors, endpoint, 1)
+
+    def record_failure(self, error):
+        self._add(self.failures, error, 1)
+
+    def drain(self):
+        """
+        Returns a copy of all collected values and starts over, values recorded meanwhile are not lost
+        """
+        drained = Telemetry()
+        with self._lock:
+            for name in ("phases", "api_calls", "api_response_bytes", "api_retries", "api_errors", "failures"):
+                setattr(drained, name, getattr(self, name))
+                setattr(self, name, {})
+        return drained
+
+    def merge(self, other):
+        """
+        Adds all values collected by other
+        """
+        for name in ("phases", "api_calls", "api_response_bytes", "api_retries", "api_errors", "failures"):
+            for key, value in getattr(other, name).items():
+                self._add(getattr(self, name), key, value)
+
+    def metrics(self):
+        """
+        Returns (metric key, value, dimensions) of all collected values
+        """
+        with self._lock:
+            metrics = [(f"{METRIC_PREFIX}.analysis.phase_duration", value, {"phase": phase}) for phase, value in self.phases.items()]
+            for name, values in (("calls", self.api_calls), ("response_bytes", self.api_response_bytes), ("retries", self.api_retries), ("errors", self.api_errors)):
+                metrics += [(f"{METRIC_PREFIX}.api.{name}", value, {"endpoint": endpoint}) for endpoint, value in values.items()]
+            metrics += [(f"{METRIC_PREFIX}.analysis.failures", value, {"error": error}) for error, value in self.failures.items()]
+            return metrics
+
+    def _add(self, values, key, amount):
+        with self._lock:
+            values[key] = values.get(key, 0) + amount
@@ -0,0 +1,311 @@
+import json, mmap, os, threading
+from array import array
+from datetime import datetime, timezone
+
+from ext_ddu_monitoring.metrics import INGEST_SERIES, DDU_BY_HOST_SERIES, ingest_key, host_key, iter_results
+from ext_ddu_monitoring.storage import state_file
+
+# Number of series a store has room for before it grows (doubling)
+INITIAL_SERIES_CAPACITY = 1024
+
+# Minutes sampled ahead of the comparison window, so most cycles need no sampling request at all
+SAMPLE_MINUTES = 5
+
+# Length of the analysis window in minutes
+WINDOW_MINUTES = 5
+
+_STAMP_SIZE = 8
+_VALUE_SIZE = 4
+_NO_STAMP = -1
+
+_baselines = {}
+_baselines_lock = threading.Lock()
+
+
+def get_baseline_store(environment_url, baseline_offset):
+    """
+    Returns the baseline store of an environment, which keeps its samples across cycles and restarts
+    """
+    key = (environment_url, baseline_offset)
+    with _baselines_lock:
+        store = _baselines.get(key)
+        if store is None:
+            store = _baselines[key] = BaselineStore(environment_url, baseline_offset)
+        return store
+
+
+def forget_baseline_stores():
+    """
+    Drops the baseline stores kept in memory, they are loaded from their files again when used next
+    """
+    with _baselines_lock:
+        _baselines.clear()
+
+
+class RollingStore:
+    """
+    Per-minute samples of many series in a ring buffer covering the last `capacity` minutes.
+
+    Samples are kept as float32 in one flat buffer, minute-major, so all series of a minute
+    are contiguous. Every slot is stamped with the minute it holds, which tells whether a
+    window is fully covered. Keys without a sample in any minute of the buffer are dropped
+    before the buffer grows, so series which disappear do not take up space. With a path
+    the buffer is a memory-mapped file and the series keys are written next to it, so the
+    history survives restarts.
+    """
+
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+
+        self.keys = []
+        self._index = {}
+        self._series_capacity = 0
+        self._buffer = None
+        self._views = []
+        self._lock = threading.Lock()
+
+        if path is None or not self._load():
+            self._allocate(INITIAL_SERIES_CAPACITY)
+
+    def record(self, minute, samples):
+        """
+        Replaces all samples of a minute (epoch minutes) with the given (key, value) pairs
+        """
+        with self._lock:
+            slot = minute % self.capacity
+            row = slot * self._series_capacity
+
+            self._values[row:row + self._series_capacity] = _zeros(self._series_capacity)
+            self._stamps[slot] = minute
+
+            for key, value in samples:
+                index = self._index.get(key)
+                if index is None:
+                    index = self._add_key(key)
+                    row = slot * self._series_capacity
+                self._values[row + index] = value
+
+    def covers(self, start_minute, end_minute):
+        with self._lock:
+            return all(self._stamps[minute % self.capacity] == minute for minute in range(start_minute, end_minute))
+
+    def window(self, start_minute, end_minute):
+        """
+        Returns the sum per series key over [start_minute, end_minute),
+        or None if a minute of the window has not been sampled
+        """
+        if end_minute - start_minute > self.capacity:
+            return None
+
+        with self._lock:
+            count = len(self.keys)
+            sums = [0.0] * count
+
+            for minute in range(start_minute, end_minute):
+                slot = minute % self.capacity
+                if self._stamps[slot] != minute:
+                    return None
+
+                row = slot * self._series_capacity
+                sums = list(map(float.__add__, sums, self._values[row:row + count].tolist()))
+
+            return {key: value for key, value in zip(self.keys, sums) if value}
+
+    def flush(self):
+        """
+        Writes the memory-mapped samples and the series keys to disk
+        """
+        if self.path is None:
+            return
+
+        with self._lock:
+            self._buffer.flush()
+
+            metadata = {
+                "capacity": self.capacity,
+                "series_capacity": self._series_capacity,
+                "keys": self.keys,
+            }
+            tmp_path = str(self.path) + ".keys.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, str(self.path) + ".keys")
+
+    def _add_key(self, key):
+        if len(self.keys) == self._series_capacity:
+            self._compact()
+        if len(self.keys) == self._series_capacity:
+            self._allocate(self._series_capacity * 2)
+
+        index = len(self.keys)
+        self.keys.append(key)
+        self._index[key] = index
+        return index
+
+    def _compact(self):
+        """
+        Drops the keys which have no sample in any minute of the buffer and moves the remaining ones together
+        """
+        count = len(self.keys)
+        live = [False] * count
+        for slot in range(self.capacity):
+            if self._stamps[slot] == _NO_STAMP:
+                continue
+            row = slot * self._series_capacity
+            live = list(map(bool.__or__, live, map(bool, self._values[row:row + count].tolist())))
+
+        keep = [index for index in range(count) if live[index]]
+        if len(keep) == count:
+            return
+
+        for slot in range(self.capacity):
+            row = slot * self._series_capacity
+            values = self._values[row:row + count].tolist()
+            self._values[row:row + len(keep)] = memoryview(array("f", [values[index] for index in keep]))
+            self._values[row + len(keep):row + count] = _zeros(count - len(keep))
+
+        self.keys = [self.keys[index] for index in keep]
+        self._index = {key: index for index, key in enumerate(self.keys)}
+
+    def _allocate(self, series_capacity):
+        # Keep a copy of the current samples, they are laid out again for the new series capacity
+        old_series_capacity = self._series_capacity
+        if self._views:
+            old_stamps = memoryview(array("q", self._stamps.tobytes()))
+            old_values = memoryview(array("f", self._values.tobytes()))
+        else:
+            old_stamps = memoryview(array("q", [_NO_STAMP]) * self.capacity)
+            old_values = None
+        self._release()
+
+        size = self.capacity * (_STAMP_SIZE + series_capacity * _VALUE_SIZE)
+        if self.path is None:
+            self._buffer = bytearray(size)
+        else:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            try:
+                os.ftruncate(fd, size)
+                self._buffer = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+        self._series_capacity = series_capacity
+        self._map_views()
+
+        self._stamps[:] = old_stamps
+        for slot in range(self.capacity):
+            row = slot * series_capacity
+            if old_values is not None:
+                old_row = slot * old_series_capacity
+                self._values[row:row + old_series_capacity] = old_values[old_row:old_row + old_series_capacity]
+            self._values[row + old_series_capacity:row + series_capacity] = _zeros(series_capacity - old_series_capacity)
+
+    def _load(self):
+        try:
+            with open(str(self.path) + ".keys", encoding="utf-8") as f:
+                metadata = json.load(f)
+
+            series_capacity = metadata["series_capacity"]
+            size = self.capacity * (_STAMP_SIZE + series_capacity * _VALUE_SIZE)
+            if metadata["capacity"] != self.capacity or os.path.getsize(self.path) != size:
+                return False
+
+            with open(self.path, "r+b") as f:
+                self._buffer = mmap.mmap(f.fileno(), size)
+
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self._series_capacity = series_capacity
+        self._map_views()
+
+        self.keys = [tuple(key) if isinstance(key, list) else key for key in metadata["keys"]]
+        self._index = {key: index for index, key in enumerate(self.keys)}
+        return True
+
+    def _map_views(self):
+        buffer = memoryview(self._buffer)
+        stamp_bytes = buffer[:self.capacity * _STAMP_SIZE]
+        value_bytes = buffer[self.capacity * _STAMP_SIZE:]
+        self._stamps = stamp_bytes.cast("q")
+        self._values = value_bytes.cast("f")
+        self._views = [self._values, self._stamps, value_bytes, stamp_bytes, buffer]
+
+    def _release(self):
+        # Views have to be released before a memory-mapped file can be closed
+        for view in self._views:
+            view.release()
+        self._views = []
+
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = None
+
+
+class BaselineStore:
+    """
+    Local copy of the comparison window of ingested data points per extension config and billed DDUs per host.
+
+    Only the minutes of the current comparison window and the next SAMPLE_MINUTES minutes are
+    kept, independent of the baseline offset. Data of the comparison window is at least an hour
+    old and therefore final, so every minute is queried only once and the window slides forward
+    with the minutes sampled ahead, instead of the whole window being queried every cycle.
+    """
+
+    def __init__(self, environment_url, baseline_offset):
+        self.baseline_offset = baseline_offset
+        capacity = WINDOW_MINUTES + SAMPLE_MINUTES
+        offset_minutes = int(baseline_offset.total_seconds() // 60)
+
+        self.ingest = RollingStore(capacity, state_file(environment_url, f"baseline_{offset_minutes}m_ingest.bin"))
+        self.ddu_by_host = RollingStore(capacity, state_file(environment_url, f"baseline_{offset_minutes}m_ddu_by_host.bin"))
+
+    def sample(self, client, datetime_to, deadline=None):
+        """
+        Records the minutes of the comparison window which are not stored yet and the SAMPLE_MINUTES
+        minutes after it, both metrics with a single request. Returns False if nothing had to be sampled.
+        """
+        start_minute, end_minute = self._baseline_window(datetime_to)
+        missing = [minute for minute in range(start_minute, end_minute) if not self._covered(minute)]
+        if not missing:
+            return False
+
+        sample_from = missing[0]
+        sample_to = end_minute + SAMPLE_MINUTES
+        time_from = datetime.fromtimestamp(sample_from * 60, timezone.utc).isoformat(timespec='milliseconds')
+        time_to = datetime.fromtimestamp(sample_to * 60, timezone.utc).isoformat(timespec='milliseconds')
+
+        stores = [(self.ingest, ingest_key), (self.ddu_by_host, host_key)]
+        samples_by_minute = [{minute: [] for minute in range(sample_from, sample_to)} for _ in stores]
+
+        for index, series in iter_results(client, [INGEST_SERIES, DDU_BY_HOST_SERIES], time_from, time_to, deadline, resolution="1m"):
+            series_key = stores[index][1](series["dimensionMap"])
+            for timestamp, value in zip(series["timestamps"], series["values"]):
+                samples = samples_by_minute[index].get(timestamp // 60000)
+                if samples is not None and value is not None:
+                    samples.append((series_key, value))
+
+        # Every minute of the range is recorded, also minutes without any series, so they count as covered
+        for (store, _), store_samples in zip(stores, samples_by_minute):
+            for minute, samples in store_samples.items():
+                store.record(minute, samples)
+            store.flush()
+        return True
+
+    def baseline_ingest(self, datetime_to):
+        return self.ingest.window(*self._baseline_window(datetime_to))
+
+    def baseline_ddu_by_host(self, datetime_to):
+        return self.ddu_by_host.window(*self._baseline_window(datetime_to))
+
+    def _covered(self, minute):
+        return self.ingest.covers(minute, minute + 1) and self.ddu_by_host.covers(minute, minute + 1)
+
+    def _baseline_window(self, datetime_to):
+        end_minute = int((datetime_to - self.baseline_offset).timestamp() // 60)
+        return end_minute - WINDOW_MINUTES, end_minute
+
+
+def _zeros(count):
+    return memoryview(array("f", bytes(count * _VALUE_SIZE)))
@@ -0,0 +1,172 @@
+import hashlib, itertools, logging, multiprocessing, queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler
+
+from ext_ddu_monitoring.analysis import analyze_endpoint, endpoint_key
+from ext_ddu_monitoring.deadline import Deadline
+
+# Maximum number of endpoints analyzed at the same time within one worker process
+MAX_PARALLEL_ENDPOINTS_PER_WORKER = 10
+
+# Time in seconds a worker process is given to exit when the pool is closed
+WORKER_SHUTDOWN_TIMEOUT = 5
+
+
+def shard(environment_url, workers):
+    """
+    Returns the index of the worker process analyzing an environment. The assignment is stable across
+    cycles and restarts, so every worker keeps the clients, caches and baseline stores of its environments warm.
+    """
+    # CRC32 is linear, so URLs differing in a single character would be distributed unevenly
+    digest = hashlib.sha256(environment_url.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % workers
+
+
+class WorkerPool:
+    """
+    Long-lived worker processes analyzing endpoints next to the extension process.
+
+    Aggregation and JSON decoding are CPU-bound, so threads of a single process are limited
+    by the GIL. Endpoints are distributed to the workers by shard() instead, and every worker
+    analyzes its endpoints in threads. Log records and self-monitoring metrics are sent back
+    through queues, as only the extension process is connected to the extension SDK.
+    """
+
+    def __init__(self, workers, logger):
+        self.workers = workers
+        self.logger = logger
+
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._logs = self._context.Queue()
+        self._tasks = [None] * workers
+        self._processes = [None] * workers
+
+        # Analyses of earlier cycles which are still running past their deadline are reported when they finish,
+        # by task ID with (endpoint, deadline, worker)
+        self._outstanding = {}
+        self._task_ids = itertools.count()
+
+        threading.Thread(target=self._forward_logs, name="ddu_worker_logs", daemon=True).start()
+
+    def run(self, endpoints, deadlines, grace_period):
+        """
+        Analyzes the endpoints in the worker processes and yields (endpoint, deadline, metrics) per analysis.
+        metrics is None for analyses which did not finish within their deadline plus the grace period.
+        Endpoints whose analysis of an earlier cycle is still running are skipped, endpoints of this cycle
+        sharing their problem state are queued one after another.
+        """
+        pending = {}
+        waiting = {}
+        for endpoint, deadline in zip(endpoints, deadlines):
+            key = endpoint_key(endpoint)
+            if key in waiting:
+                waiting[key].append((endpoint, deadline))
+                continue
+
+            # Restarts the worker if it exited, which forgets its outstanding analyses
+            worker = shard(endpoint["environment_url"], self.workers)
+            self._worker_tasks(worker)
+
+            if any(endpoint_key(running) == key for running, _, _ in self._outstanding.values()):
+                self.logger.warning(f"Analysis of endpoint {key[0]} with problem text {key[1]} from an earlier cycle is still running, skipping it in this cycle.")
+                continue
+
+            waiting[key] = []
+            self._queue(worker, endpoint, deadline, pending)
+
+        while pending:
+            timeout = max(deadline.remaining() for _, deadline in pending.values()) + grace_period
+            try:
+                task_id, metrics = self._results.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            endpoint, deadline, worker = self._outstanding.pop(task_id, (None, None, None))
+            if pending.pop(task_id, None) is not None and waiting[endpoint_key(endpoint)]:
+                self._queue(worker, *waiting[endpoint_key(endpoint)].pop(0), pending)
+            if endpoint is not None:
+                yield endpoint, deadline, metrics
+
+        for endpoint, deadline in pending.values():
+            yield endpoint, deadline, None
+        for queued in waiting.values():
+            for endpoint, deadline in queued:
+                yield endpoint, deadline, None
+
+    def _queue(self, worker, endpoint, deadline, pending):
+        task_id = next(self._task_ids)
+        self._outstanding[task_id] = (endpoint, deadline, worker)
+        pending[task_id] = (endpoint, deadline)
+
+        # Worker processes do not share the monotonic clock, so the deadline is sent as wall-clock time
+        self._worker_tasks(worker).put((task_id, endpoint, time.time() + deadline.remaining(), deadline.seconds))
+
+    def close(self):
+        for tasks in self._tasks:
+            if tasks is not None:
+                tasks.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(WORKER_SHUTDOWN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+
+    def _worker_tasks(self, worker):
+        """
+        Returns the task queue of a worker, (re)starting the worker process if it is not running
+        """
+        process = self._processes[worker]
+        if process is None or not process.is_alive():
+            if process is not None:
+                self.logger.warning(f"Worker process {worker} exited with code {process.exitcode}, restarting it.")
+
+                # Analyses of the exited process never report back
+                self._outstanding = {
+                    task_id: outstanding for task_id, outstanding in self._outstanding.items() if outstanding[2] != worker
+                }
+
+            self._tasks[worker] = self._context.Queue()
+            process = self._processes[worker] = self._context.Process(
+                target=_work,
+                args=(self._tasks[worker], self._results, self._logs, self.logger.getEffectiveLevel()),
+                name=f"ddu_worker_{worker}",
+                daemon=True
+            )
+            process.start()
+
+        return self._tasks[worker]
+
+    def _forward_logs(self):
+        while True:
+            record = self._logs.get()
+            self.logger.handle(record)
+
+
+def _work(tasks, results, logs, log_level):
+    """
+    Main function of a worker process
+    """
+    logger = logging.getLogger("ext_ddu_monitoring")
+    logger.handlers = [QueueHandler(logs)]
+    logger.setLevel(log_level)
+    logger.propagate = False
+
+    executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_ENDPOINTS_PER_WORKER, thread_name_prefix="ddu_endpoint")
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        executor.submit(_analyze, task, results, logger)
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _analyze(task, results, logger):
+    task_id, endpoint, expires_at, seconds = task
+    try:
+        metrics = analyze_endpoint(endpoint, Deadline.at(expires_at, seconds), logger)
+    except Exception:
+        logger.exception(f"Analysis of endpoint {endpoint['environment_url']} failed in worker process.")
+        metrics = []
+    results.put((task_id, metrics))